@@ -1,13 +1,16 @@
-from flask import Flask, render_template, request, send_file
+from flask import Flask, Response, render_template, request, send_file
 from flask import url_for, jsonify
 
 import json
-from pydub import AudioSegment
 from werkzeug.urls import url_unquote
 import io
 import os
 
-from construction import L, make_scratch, names_in_formula
+from cache import LRUCache
+from classes import preload_instrumental
+from samples import SampleRegistry
+from construction import L, canonical, compile_codebook, fingerprint
+from construction import make_scratch, names_in_formula
 from analysis import get_info
 from library import get_tutorial
 from globals import FORMULA_SYMBOLS
@@ -23,11 +26,30 @@ with open(f'{PATH}resources/json/COMBINED.json', 'r') as file:
 with open(f'{PATH}resources/json/codebook.json', 'r') as file:
     codebook = json.load(file)
 
-with open(f"{PATH}resources/audio/ahhh.wav", "rb") as file:
-    SAMPLE = AudioSegment.from_file(file, format="wav")
+CODEBOOK_SCRATCHES = compile_codebook(codebook) # codebook names to scratches
 
-with open(f"{PATH}resources/audio/beat75bpm.wav", "rb") as file:
-    BEAT = AudioSegment.from_file(file, format="wav")
+REGISTRY = SampleRegistry() # memory-mapped, shared between workers
+SAMPLE = REGISTRY.register("ahhh", f"{PATH}resources/audio/ahhh.wav")
+BEAT = REGISTRY.register("beat75bpm", f"{PATH}resources/audio/beat75bpm.wav")
+
+preload_instrumental(BEAT, SAMPLE, bpm=90, num_beats=4, max_beats=16)
+
+### Caches (keyed by scratch fingerprint, shared by all spellings of a formula)
+##############################################################################
+
+INFOS = LRUCache(maxsize=1024) # scratch infos
+FIGURES = LRUCache(maxsize=512, maxbytes=64 * 2**20, 
+                  sizeof=len) # svg and png files
+
+def _figure(scratch, name, draw, **kwargs):
+    """Returns the (cached) file of a figure of scratch drawn by draw"""
+    def render():
+        fig = draw()
+        fig.tight_layout()
+        file = io.BytesIO()
+        fig.savefig(file, **kwargs)
+        return file.getvalue()
+    return FIGURES.get_or_put((fingerprint(scratch), name), render)
 
 ### Initialize App
 ##############################################################################
@@ -69,7 +91,9 @@ def process_formula():
                 "message": f'You cannot use "{char}" in a formula.',
             })
     try:
-        info = get_info(make_scratch(formula, codebook))
+        scratch = make_scratch(formula, CODEBOOK_SCRATCHES)
+        key = fingerprint(scratch)
+        info = INFOS.get_or_put(key, lambda: get_info(scratch))
         if info["length"] > 16:
             return jsonify({
                 "isWorking": False,
@@ -89,6 +113,8 @@ def process_formula():
             "isWorking": True,
             "isEmpty": False,
             "processedFormula":formula,
+            "canonicalFormula":canonical(formula, codebook),
+            "fingerprint":key,
             "info":info,
             "tutorials":tutorials,
         })
@@ -110,49 +136,91 @@ def process_formula():
 
 @app.route('/formulas/<encoded_formula>/scratchbook_ttm', methods=['GET', ])
 def formula_to_svg(encoded_formula):
-    """Returns svg for formula"""
+    """
+    Returns svg for formula (written directly, or ?backend=matplotlib to 
+    draw it as a matplotlib figure)
+    """
     formula = url_unquote(encoded_formula).replace("$","/")
+    backend = request.values.get('backend', 'svg')
     try:
-        fig = make_scratch(formula, codebook).TTM(size=3)
+        scratch = make_scratch(formula, CODEBOOK_SCRATCHES)
+        if backend == "svg":
+            svg = FIGURES.get_or_put((fingerprint(scratch), "svg"), 
+                lambda: scratch.TTM_svg(size=3).encode())
+        elif backend == "matplotlib":
+            svg = _figure(scratch, "matplotlib svg", 
+                          lambda: scratch.TTM(size=3), format="svg")
+        else:
+            raise ValueError(f'Unknown backend: "{backend}"')
     except Exception as ex:
         return render_template('formula_error.html', 
             type=type(ex).__name__, args=ex.args)
-    fig.tight_layout()
-    file = io.BytesIO()
-    fig.savefig(file, format="svg")
-    file.seek(0)
-    return send_file(file, mimetype='image/svg+xml')
+    return send_file(io.BytesIO(svg), mimetype='image/svg+xml')
 
 @app.route('/formulas/<encoded_formula>/scratchbook_audio', methods=['GET', ])
 def formula_to_audio(encoded_formula):
-    """Returns audio for formula"""
+    """
+    Returns audio for formula (?quality=draft for quick auditioning, 
+    ?sample=<name> for another registered sample). The audio is rendered in 
+    the grain-free "continuous" mode, so the draft tier only renders mono at
+    a reduced frame rate here (its fewer grains apply to the "grain" mode).
+    """
+    formula = url_unquote(encoded_formula).replace("$","/")
+    quality = request.values.get('quality', 'full')
+    sample_name = request.values.get('sample', 'ahhh')
+    try:
+        sample = REGISTRY[sample_name]
+        scratch = make_scratch(formula, CODEBOOK_SCRATCHES)
+        audio = scratch.stream_wav(
+            sample=sample, bpm=90, instrumental=BEAT,
+            muting_color="w", muting_curve=L, mode="continuous", 
+            quality=quality)
+    except Exception as ex:
+        return render_template('formula_error.html', 
+            type=type(ex).__name__, args=ex.args)
+    etag = f"{fingerprint(scratch)}-{sample_name}-{quality}"
+    if etag in request.if_none_match:
+        return Response(status=304)
+    response = Response(audio, mimetype='audio/wav') # chunked, block by block
+    response.set_etag(etag)
+    return response
+
+@app.route('/formulas/<encoded_formula>/scratchbook_motion', methods=['GET', ])
+def formula_to_motion(encoded_formula):
+    """
+    Returns the sampled motion of formula (?format=csv or npz, ?ppb=<points 
+    per beat>)
+    """
     formula = url_unquote(encoded_formula).replace("$","/")
+    file_format = request.values.get('format', 'csv')
     try:
-        audio = make_scratch(formula, codebook).audio(
-            sample=SAMPLE, bpm=90, instrumental=BEAT,
-            muting_color="w", muting_curve=L)
+        ppb = int(request.values.get('ppb', 100))
+        if not 1 <= ppb <= 1000:
+            raise ValueError('The resolution must be 1 to 1000 points per beat.')
+        scratch = make_scratch(formula, CODEBOOK_SCRATCHES)
+        if scratch.length > 16:
+            raise ValueError('Currently, your scratch cannot be longer than 16 beats.')
+        motion = scratch.export_motion(rate=ppb, click=60 / 1000 * 90 / 60, 
+            format=file_format) # 60 ms clicks at 90 bpm
     except Exception as ex:
         return render_template('formula_error.html', 
             type=type(ex).__name__, args=ex.args)
-    file = io.BytesIO()
-    audio.export(file, format="wav")
-    file.seek(0)
-    return send_file(file, mimetype='audio/wav')
+    mimetype = 'text/csv' if file_format == 'csv' else 'application/octet-stream'
+    return send_file(io.BytesIO(motion), mimetype=mimetype, as_attachment=True,
+                     download_name=f"motion.{file_format}")
 
 @app.route('/formulas/<encoded_formula>/png', methods=['GET', ])
 def formula_to_png(encoded_formula):
     """Returns png for formula"""
     formula = url_unquote(encoded_formula).replace("$","/")
     try:
-        fig = make_scratch(formula, codebook).TTM()
+        scratch = make_scratch(formula, CODEBOOK_SCRATCHES)
+        png = _figure(scratch, "png", scratch.TTM, format="png", 
+                      bbox_inches='tight')
     except Exception as ex:
         return render_template('formula_error.html', 
              type=type(ex).__name__, args=ex.args)
-    fig.tight_layout()
-    file = io.BytesIO()
-    fig.savefig(file, format="png", bbox_inches='tight')
-    file.seek(0)
-    return send_file(file, mimetype='image/png')
+    return send_file(io.BytesIO(png), mimetype='image/png')
 
 @app.route('/formulas/<encoded_formula>/preview', methods=['GET', ])
 def formula_to_preview(encoded_formula):
@@ -162,15 +230,12 @@ def formula_to_preview(encoded_formula):
         return send_file(f'{PATH}resources/previews/{formula}.png', 
                         mimetype='image/png')
     try:
-        fig = make_scratch(formula, codebook).preview()
+        scratch = make_scratch(formula, CODEBOOK_SCRATCHES)
+        png = _figure(scratch, "preview", scratch.preview, format="png")
     except Exception as ex:
         return render_template('formula_error.html', 
             type=type(ex).__name__, args=ex.args)
-    fig.tight_layout()
-    file = io.BytesIO()
-    fig.savefig(file, format="png")
-    file.seek(0)
-    return send_file(file, mimetype='image/png')
+    return send_file(io.BytesIO(png), mimetype='image/png')
 
 @app.route('/figures/classes')
 def classes():
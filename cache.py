@@ -0,0 +1,89 @@
+"""
+`scratchbook.cache` implements the following class:
+`LRUCache`
+    A bounded least-recently-used cache with hit and miss counters.
+"""
+
+import threading
+from collections import OrderedDict
+
+_missing = object()
+
+class LRUCache:
+    """
+    A thread-safe mapping that evicts its least recently used entries once it
+    holds more than `maxsize` of them or more than `maxbytes` in total.
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=None):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            The maximum number of entries.
+        maxbytes : int
+            The maximum total size of the values, or None for no limit.
+        sizeof : function
+            A function returning the size of a value in bytes. Defaults to the
+            `nbytes` of the value (e.g. of a numpy array).
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof or (lambda value: getattr(value, "nbytes", 0))
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Returns the value for key (marking it as recently used) or default."""
+        with self._lock:
+            value = self._data.get(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores value under key and evicts the least recently used entries."""
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self.sizeof(self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.bytes += self.sizeof(value)
+            while self._data and (len(self._data) > self.maxsize or (
+                self.maxbytes is not None and self.bytes > self.maxbytes)):
+                self.bytes -= self.sizeof(self._data.popitem(last=False)[1])
+
+    def get_or_put(self, key, factory):
+        """
+        Returns the value for key, calling factory() to create and store it if
+        it is missing.
+        """
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.bytes = 0
+
+    def info(self):
+        """dict: The hits, misses, current and maximum size of the cache"""
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._data), "maxsize": self.maxsize,
+                "bytes": self.bytes, "maxbytes": self.maxbytes}
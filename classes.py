@@ -8,12 +8,23 @@
     A scratch made of one or more elements.
 """
 
+import io
+import struct
+import wave
+from collections import namedtuple
+
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
+from matplotlib.collections import LineCollection, PatchCollection
 from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
 from pydub import AudioSegment
 
+from cache import LRUCache
+from samples import _DTYPES, SampleStore, as_store
+from svg import ttm_svg
+
 class MyLocator(matplotlib.ticker.AutoMinorLocator):
     def __init__(self, n=12):
         super().__init__(n=n)
@@ -26,23 +37,146 @@ slicetype = slice # to avoid name collision with "slice" scratch
 ### Helper Functions 
 ##############################################################################
 
-def _findx(y, f, lower=0, upper=1, rounds=25, margin=0.0001):
+def _bisect(f, y, lower=0, upper=1, rounds=25):
     """
-    Binary search for x given y using f in the domain from lower to upper.
-    Assumes that f is defined between lower and upper and is continuous and 
-    strictly monotonic
+    Lock-step binary search for the x values of an array of y values using f in 
+    the domain from lower to upper. Assumes that f is defined between lower and 
+    upper and is continuous and monotonic.
     """
-    for i in range(1, rounds + 1):
+    y = np.asarray(y, dtype=float)
+    lower = np.full(y.shape, lower, dtype=float)
+    upper = np.full(y.shape, upper, dtype=float)
+    first, last = f(np.array([0., 1.]))
+    rising = first <= last
+    for _ in range(rounds):
         x = (upper + lower) / 2
-        thisy = f(x)
-        if abs(thisy - y) < margin:
-            return x
-        elif thisy < y:
-            lower = x
-        else:
-            upper = x
-    print("-> recursion limit reached at {i} rounds.")
-    return x
+        below = f(x) < y if rising else f(x) > y
+        lower = np.where(below, x, lower)
+        upper = np.where(below, upper, x)
+    return (upper + lower) / 2
+
+WARP_MAPS = LRUCache(maxsize=256) # warp maps by curve, variant and grain
+
+def _warp_map(curve, variant, grain):
+    """
+    Returns the (cached) x-locations at which each of the grain equal sample 
+    slices starts and ends when played along a curve variant.
+    """
+    def make():
+        ycuts = np.linspace(start=0, stop=1, num=grain + 1)
+        xcuts = curve.findx(ycuts[1:-1], variant) # exclude first and last points, since their x are 0 and 1
+        xcuts = np.concatenate([[0], xcuts, [1]]) # give them points back
+        xcuts.flags.writeable = False # shared between renders
+        return xcuts
+    return WARP_MAPS.get_or_put((curve, variant, grain), make)
+
+RENDERS = LRUCache(maxsize=2048, maxbytes=128 * 2**20, 
+                   sizeof=lambda entry: entry[1].nbytes) # rendered elements
+
+def _render_cached(el, store, out, **kwargs):
+    """
+    Writes the render of an element into out, reusing an earlier render of 
+    the same element geometry with the same sample store if there is one.
+    """
+    if el._muted(kwargs.get("muting_color"), kwargs.get("muting_curve")):
+        out[:] = 0
+        return out
+    key = (el.curve, el.xflip, el.yflip, el.length, el.height, el.lift, 
+           id(store), len(out), kwargs.get("grain", 50), 
+           kwargs.get("mode", "grain"))
+    entry = RENDERS.get(key)
+    if entry is None:
+        el._render(store, out=out, **kwargs)
+        rendered = out.copy()
+        rendered.flags.writeable = False
+        RENDERS.put(key, (store, rendered)) # keeps id(store) from being reused
+    else:
+        out[:] = entry[1]
+    return out
+
+INSTRUMENTALS = LRUCache(maxsize=64, maxbytes=32 * 2**20, 
+                         sizeof=lambda entry: entry[1].nbytes) # tempo-fitted beds
+
+def _fit_instrumental(instrumental, num_beats, target_beats, bpm, frame_rate, 
+                      channels):
+    """
+    Returns the (cached) instrumental, cut or repeated to target_beats and 
+    rescaled to bpm, as a read-only array at frame_rate with channels (in 
+    the integer type of the instrumental, at half the size of floats).
+    """
+    instrumental = as_store(instrumental)
+    key = (id(instrumental), num_beats, target_beats, bpm, frame_rate, channels)
+    entry = INSTRUMENTALS.get(key)
+    if entry is not None:
+        return entry[1]
+    beat = _match_channels(instrumental.pcm, channels)
+    frames_beat = len(beat) / num_beats
+    if num_beats > target_beats:
+        beat = beat[:round(target_beats * frames_beat)]
+    elif num_beats < target_beats:
+        beat = np.concatenate(
+            [beat] * (int(target_beats / num_beats)) 
+            + [beat[:round((target_beats % num_beats) * frames_beat)]])
+    beat = _to_pcm(_resample(beat, round(target_beats * 60 * frame_rate / bpm)), 
+                   instrumental.sample_width)
+    beat.flags.writeable = False
+    INSTRUMENTALS.put(key, (instrumental, beat)) # keeps id(instrumental) from being reused
+    return beat
+
+def preload_instrumental(instrumental, sample, bpm=90, num_beats=4, 
+                         max_beats=16):
+    """
+    Fits the instrumental to every scratch length up to max_beats ahead of 
+    time, so that rendering a scratch over it only needs to overlay.
+
+    Parameters
+    ----------
+    instrumental : SampleStore or AudioSegment
+        The beat sample to be used.
+    sample : SampleStore or AudioSegment
+        The scratch sample to be used (sets frame rate and channels).
+    bpm : int
+        The number of beats per minute.
+    num_beats : int
+        The length of the instrumental in number of beats.
+    max_beats : int
+        The maximum length of a scratch in number of beats.
+    """
+    sample = as_store(sample)
+    for target_beats in range(1, max_beats + 1):
+        _fit_instrumental(instrumental, num_beats, target_beats, bpm, 
+            sample.frame_rate, sample.channels)
+
+QUALITIES = { # render settings per quality tier, None keeps the sample's own
+    "full": {"frame_rate": None, "channels": None, "grain": 50},
+    "draft": {"frame_rate": 11025, "channels": 1, "grain": 16},
+}
+
+SAMPLES = LRUCache(maxsize=16, maxbytes=64 * 2**20, 
+                   sizeof=lambda entry: entry[1].pcm.nbytes) # converted samples
+
+def _for_quality(sample, quality):
+    """
+    Returns the sample as a (cached) SampleStore converted to the frame rate 
+    and channels of a quality tier, and the grain of the tier.
+    """
+    if not quality in QUALITIES:
+        raise ValueError(f'Unknown quality: "{quality}"')
+    sample = as_store(sample)
+    settings = QUALITIES[quality]
+    frame_rate = min(settings["frame_rate"] or sample.frame_rate, 
+                     sample.frame_rate)
+    channels = settings["channels"] or sample.channels
+    if (frame_rate, channels) == (sample.frame_rate, sample.channels):
+        return sample, settings["grain"]
+    key = (id(sample), frame_rate, channels)
+    entry = SAMPLES.get(key)
+    if entry is None:
+        entry = (sample, # keeps id(sample) from being reused
+                 SampleStore.from_segment(sample.segment().set_channels(
+                     channels).set_frame_rate(frame_rate)))
+        SAMPLES.put(key, entry)
+    return entry[1], settings["grain"]
 
 def _pairwise(iterable): # make my own...
     import itertools 
@@ -62,6 +196,330 @@ def _milliseconds(sound, ms):
     })
     return output.set_frame_rate(sound.frame_rate) # reset framerate
 
+def _to_pcm(array, sample_width):
+    """
+    Rounds and clips a float array to the integer type of the sample width.
+    """
+    dtype = _DTYPES[sample_width]
+    info = np.iinfo(dtype)
+    return np.clip(np.rint(array), info.min, info.max).astype(dtype)
+
+def _to_segment(array, frame_rate, sample_width):
+    """
+    Turns an array of shape (frames, channels) into an AudioSegment.
+    """
+    return AudioSegment(data=_to_pcm(array, sample_width).tobytes(), 
+        sample_width=sample_width, frame_rate=frame_rate, 
+        channels=array.shape[1])
+
+def _to_wav(array, frame_rate, sample_width):
+    """
+    Turns an array of shape (frames, channels) into the bytes of a wav file.
+    """
+    file = io.BytesIO()
+    with wave.open(file, "wb") as w:
+        w.setnchannels(array.shape[1])
+        w.setsampwidth(sample_width)
+        w.setframerate(frame_rate)
+        w.writeframes(_to_pcm(array, sample_width).tobytes())
+    return file.getvalue()
+
+def _wav_header(frames, channels, sample_width, frame_rate):
+    """
+    Returns the 44 byte header of a PCM wav file with the given number of frames.
+    """
+    data = frames * channels * sample_width
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data, b"WAVE", 
+        b"fmt ", 16, 1, channels, frame_rate, frame_rate * channels * sample_width,
+        channels * sample_width, sample_width * 8, b"data", data)
+
+def _blocks(arrays, frames, channels):
+    """
+    Regroups a stream of arrays of shape (n, channels) into arrays of exactly
+    `frames` frames (except for the last one).
+    """
+    block = np.empty((frames, channels), dtype=np.float32)
+    filled = 0
+    for array in arrays:
+        while len(array):
+            n = min(frames - filled, len(array))
+            block[filled:filled + n] = array[:n]
+            array = array[n:]
+            filled += n
+            if filled == frames:
+                yield block
+                block = np.empty((frames, channels), dtype=np.float32)
+                filled = 0
+    if filled:
+        yield block[:filled]
+
+def _match_channels(array, channels):
+    """
+    Up- or downmixes an array of shape (frames, channels) to a number of channels.
+    """
+    if array.shape[1] == channels:
+        return array
+    mono = array.mean(axis=1, keepdims=True)
+    return np.repeat(mono, channels, axis=1)
+
+def _interpolate(pcm, positions, out=None):
+    """
+    Reads pcm at fractional frame positions by linear interpolation between
+    neighbouring frames.
+    """
+    positions = np.clip(positions, 0, len(pcm) - 1)
+    lower = positions.astype(np.intp)
+    upper = np.minimum(lower + 1, len(pcm) - 1)
+    frac = (positions - lower).astype(np.float32)[:, None]
+    if out is None:
+        out = np.empty((len(positions), pcm.shape[1]), dtype=np.float32)
+    lower = pcm.take(lower, axis=0)
+    np.subtract(pcm.take(upper, axis=0), lower, out=out, dtype=np.float32)
+    out *= frac
+    out += lower
+    return out
+
+def _resample(pcm, frames):
+    """
+    Rescales a pcm array to a given number of frames (the NumPy counterpart of 
+    `_milliseconds`).
+    """
+    if frames == len(pcm):
+        return pcm
+    if not frames > 0:
+        raise ValueError("Amount must be greater than 0")
+    positions = np.arange(frames) * (len(pcm) / frames)
+    return _interpolate(pcm, positions)
+
+def _click_envelope(elements, frames, frame_rate, click_ms=60, fade_ms=10):
+    """
+    Returns the crossfader gain of a sequence of rendered elements: zeros while
+    a click closes the fader, linear ramps of fade_ms before and after, and 
+    ones elsewhere.
+
+    Parameters
+    ----------
+    elements : iterable
+        (start, stop, clicks) tuples: the frame range of each element and the 
+        relative x-locations of its clicks.
+    frames : int
+        The total number of frames.
+    """
+    envelope = np.ones(frames, dtype=np.float32)
+    half = round(click_ms / 2 * frame_rate / 1000)
+    fade = max(round(fade_ms * frame_rate / 1000), 1)
+    fade_out = np.linspace(1, 0, fade, endpoint=False, dtype=np.float32)
+    fade_in = np.linspace(0, 1, fade, endpoint=False, dtype=np.float32)
+    for start, stop, clicks in elements:
+        for c in clicks:
+            i = start + int(np.round(c * (stop - start)))
+            a, b = max(i - half, start), min(i + half, stop) # fader closed
+            lo, hi = max(a - fade, start), min(b + fade, stop)
+            envelope[lo:a] *= fade_out[fade - (a - lo):]
+            envelope[b:hi] *= fade_in[:hi - b]
+            envelope[a:b] = 0
+    return envelope
+
+
+### Scratch columns
+##############################################################################
+
+Columns = namedtuple("Columns", ["curve", "length", "height", "lift", "xflip", 
+                                 "yflip", "color", "clicks", "offsets"])
+Columns.__doc__ = """
+The elements of a scratch as read-only arrays (shared between scratches, 
+caches and threads): one entry per element in every column but the last 
+two, the clicks of all elements in a row in `clicks`, and where the clicks 
+of each element start and end in `offsets` (one entry more than elements).
+"""
+
+CURVE_TABLE = [] # curves by id, for the curve column
+_CURVE_IDS = {}
+
+def _curve_id(curve):
+    """Returns the id of a curve in CURVE_TABLE, adding the curve if new"""
+    if not curve in _CURVE_IDS:
+        _CURVE_IDS[curve] = len(CURVE_TABLE)
+        CURVE_TABLE.append(curve)
+    return _CURVE_IDS[curve]
+
+def _readonly(columns):
+    """Returns columns after making all their arrays read-only"""
+    for column in columns:
+        column.flags.writeable = False # shared between scratches
+    return columns
+
+def _to_columns(elements):
+    """Returns the columns of a list of elements"""
+    return _readonly(Columns(
+        curve=np.array([_curve_id(el.curve) for el in elements], dtype=np.intp),
+        length=np.array([el.length for el in elements], dtype=float),
+        height=np.array([el.height for el in elements], dtype=float),
+        lift=np.array([el.lift for el in elements], dtype=float),
+        xflip=np.array([el.xflip for el in elements], dtype=bool),
+        yflip=np.array([el.yflip for el in elements], dtype=bool),
+        color=np.array([el.color for el in elements], dtype=object),
+        clicks=np.array([i for el in elements for i in el.clicks], dtype=float),
+        offsets=np.cumsum([0] + [len(el.clicks) for el in elements])))
+
+def _to_elements(columns):
+    """Returns element views of columns"""
+    clicks, offsets = columns.clicks.tolist(), columns.offsets.tolist()
+    return tuple(Element(CURVE_TABLE[curve], clicks[start:stop], xflip, yflip, 
+                         length, height, lift, color)
+        for curve, start, stop, xflip, yflip, length, height, lift, color 
+        in zip(columns.curve.tolist(), offsets[:-1], offsets[1:], 
+               columns.xflip.tolist(), columns.yflip.tolist(), 
+               columns.length.tolist(), columns.height.tolist(), 
+               columns.lift.tolist(), columns.color.tolist()))
+
+def _take(columns, index):
+    """Returns the columns of the elements at an array of indices"""
+    starts = columns.offsets[index]
+    counts = columns.offsets[index + 1] - starts
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+    positions = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+    return _readonly(Columns(*(column[index] for column in columns[:7]), 
+                             columns.clicks[positions], offsets))
+
+def _concat(parts):
+    """Returns the columns of the elements of a list of columns, in a row"""
+    shifts = np.cumsum([0] + [len(part.clicks) for part in parts[:-1]])
+    offsets = np.concatenate([[0]] + [part.offsets[1:] + shift 
+                                      for part, shift in zip(parts, shifts)])
+    return _readonly(Columns(*(np.concatenate(column) 
+        for column in zip(*(part[:8] for part in parts))), offsets))
+
+def _transform(columns, xscale, yscale, yshift, reverse):
+    """
+    Returns columns with lengths scaled by xscale, every y mapped to
+    yscale * y + yshift (mirrored if yscale is negative) and the order of the
+    elements reversed if reverse.
+    """
+    bottom = columns.lift if yscale > 0 else columns.lift + columns.height
+    columns = columns._replace(length=columns.length * xscale, 
+        height=abs(yscale) * columns.height, lift=yscale * bottom + yshift, 
+        yflip=columns.yflip ^ (yscale < 0))
+    if reverse: # ~ of every element, back to front
+        columns = Columns(*(column[::-1] for column in columns[:7]), 
+            1 - columns.clicks[::-1], columns.offsets[-1] - columns.offsets[::-1])
+        columns = columns._replace(xflip=~columns.xflip)
+    return _readonly(columns)
+
+
+VARIANTS = ["forward", "reverse", "backward", "inverse"] # by xflip + 2 * yflip
+
+Motion = namedtuple("Motion", ["time", "position", "fader", "offsets", 
+                               "click_time", "click_position"])
+Motion.__doc__ = """
+The sampled motion of a scratch: the time (in beats), platter position 
+(relative to the sample) and fader state (True while open) of each point, 
+where the points of each element start and end in `offsets` (one entry more
+than elements), and the time and platter position of every click.
+"""
+
+def _sample(columns, rate, click=0.):
+    """
+    Returns the Motion of columns sampled at rate points per beat, with 
+    every element sampled from its start to its end and the fader closed 
+    within click / 2 beats around each click (within its element).
+    """
+    counts = np.rint(columns.length * rate).astype(np.intp) + 1
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    element = np.repeat(np.arange(len(counts)), counts)
+    steps = np.maximum(counts - 1, 1)
+    x = (np.arange(offsets[-1]) - offsets[element]) / steps[element] # normalized
+    starts = np.concatenate([[0], np.cumsum(columns.length)[:-1]])
+    time = starts[element] + x * columns.length[element]
+    position = np.empty_like(x)
+    variants = columns.curve * 4 + columns.xflip + 2 * columns.yflip
+    for variant in np.unique(variants): # one call per curve variant
+        points = (variants == variant)[element]
+        f = getattr(CURVE_TABLE[variant // 4], VARIANTS[variant % 4])
+        position[points] = f(x[points])
+    position = position * columns.height[element] + columns.lift[element]
+    # the clicks, interpolated between the points around them
+    owner = np.repeat(np.arange(len(counts)), np.diff(columns.offsets))
+    at = columns.clicks * (counts - 1)[owner] # in points from element start
+    before = np.minimum(np.floor(at).astype(np.intp), 
+                        np.maximum(counts - 2, 0)[owner])
+    weight = at - before
+    first = offsets[owner] + before
+    second = np.minimum(first + 1, offsets[owner + 1] - 1)
+    click_position = position[first] * (1 - weight) + position[second] * weight
+    click_time = starts[owner] + columns.clicks * columns.length[owner]
+    # the fader, closed from the first to the last point of every click
+    half = click / 2 * rate
+    lower = np.clip(np.ceil(at - half), 0, counts[owner]).astype(np.intp)
+    upper = np.clip(np.floor(at + half) + 1, lower, counts[owner]).astype(np.intp)
+    closed = np.zeros(len(time) + 1, dtype=np.intp)
+    np.add.at(closed, offsets[owner] + lower, 1)
+    np.add.at(closed, offsets[owner] + upper, -1)
+    fader = np.cumsum(closed[:-1]) == 0
+    return Motion(time, position, fader, offsets, click_time, click_position)
+
+def _repeat(motion, n, length):
+    """Returns a motion repeated n times, every repeat length beats later"""
+    def shifted(times, points):
+        return np.tile(times, n) + np.repeat(np.arange(n) * length, points)
+    offsets = np.concatenate([[0]] + [motion.offsets[1:] + i * motion.offsets[-1] 
+                                      for i in range(n)])
+    return Motion(shifted(motion.time, len(motion.time)), 
+        np.tile(motion.position, n), np.tile(motion.fader, n), offsets, 
+        shifted(motion.click_time, len(motion.click_time)),
+        np.tile(motion.click_position, n))
+
+def _compose(first, then):
+    """
+    Returns the pending transform of applying first and then then, either of
+    which may be None (no transform).
+    """
+    if then is None:
+        return first
+    xs, ys, yt, rev = first or (1., 1., 0., False)
+    xscale, yscale, yshift, reverse = then
+    return (xs * xscale, ys * yscale, yt * yscale + yshift, rev != reverse)
+
+def _leaves(parts):
+    """
+    Yields the scratches of a rope in order, descending (without recursion)
+    into the parts that are ropes themselves (unless already flattened) and 
+    handing the pending transforms of these down to their parts.
+    """
+    stack = [(part, None) for part in reversed(parts)]
+    while stack:
+        part, pending = stack.pop()
+        if (part._columns is None and isinstance(part._base, _Rope) 
+            and part._base._columns is None):
+            pending = _compose(part._pending, pending)
+            children = part._base.parts
+            if pending is not None and pending[3]: # reversed, back to front
+                children = children[::-1]
+            stack.extend((child, pending) for child in reversed(children))
+        elif pending is None:
+            yield part
+        else:
+            yield part._transformed(*pending)
+
+class _Rope:
+    """
+    The parts (scratches) of a concatenation, only flattened into columns
+    once these are needed, i.e. in linear time however the parts were
+    combined.
+    """
+    __slots__ = ("parts", "_columns")
+
+    def __init__(self, parts):
+        self.parts = parts
+        self._columns = None
+
+    @property
+    def columns(self):
+        """Columns: The elements of all parts, in a row"""
+        if self._columns is None:
+            self._columns = _concat([part.columns for part in _leaves(self.parts)])
+        return self._columns
+
 
 ### Classes
 ##############################################################################
@@ -72,23 +530,53 @@ class Curve:
     y-axis
     """
 
-    def __init__(self, f):
+    def __init__(self, f, finv=None):
         """
         Parameters
         ----------
         f : function
             A function of x whose return values for 0 and 1 are 0 and 1, repectively.
+        finv : function
+            Optional exact inverse of f, i.e. a function of y returning x.
         """
         self.forward = self.f = f
         self.backward =  self.b = lambda x: -f(x) + 1
         self.reverse = self.r = lambda x: f(1-x)
         self.inverse = self.i = lambda x: -f(1-x) + 1
+        self.inverses = None
+        if finv is not None:
+            self.inverses = {
+                "forward": finv,
+                "backward": lambda y: finv(1-y),
+                "reverse": lambda y: -finv(y) + 1,
+                "inverse": lambda y: -finv(1-y) + 1,
+            }
+
+    def findx(self, y, variant="forward"):
+        """
+        Returns the x values for an array of y values of a curve variant, using
+        the exact inverse if there is one and a binary search otherwise.
+
+        Parameters
+        ----------
+        y : array_like
+            The y values, all between 0 and 1.
+        variant : str
+            One of "forward", "backward", "reverse" or "inverse".
+        """
+        if self.inverses:
+            return self.inverses[variant](np.asarray(y, dtype=float))
+        return _bisect(getattr(self, variant), y)
 
 class Element:
     """
-    A class to define a scratch element
+    A class to define a scratch element (immutable, so that elements can be
+    shared between scratches, caches and threads)
     """
 
+    __slots__ = ("curve", "clicks", "xflip", "yflip", "length", "height", 
+                 "lift", "color")
+
     def __init__(self, curve, clicks=[], xflip=False, yflip=False, length=1, 
                              height=1, lift=0, color="k"):
         """
@@ -98,7 +586,7 @@ class Element:
             The scratch curve to be used by the scratch element.
         clicks: list
             A list of int or float values, all between 0 and 1. The relative
-            x-locations of the crossfader clicks.
+            x-locations of the crossfader clicks (stored as a tuple).
         xflip: bool
             Whether or not the curve should be flipped along the x-axis.
         yflip: bool
@@ -112,14 +600,18 @@ class Element:
             A value between 0 and 1. The amount by the scratch element is lifted
             along the y-axis.
         """
-        self.curve = curve
-        self.clicks = [float(i) for i in clicks]
-        self.xflip = xflip
-        self.yflip = yflip
-        self.length = float(length)
-        self.height = float(height)
-        self.lift = float(lift)
-        self.color = color
+        init = super().__setattr__
+        init("curve", curve)
+        init("clicks", tuple(float(i) for i in clicks))
+        init("xflip", xflip)
+        init("yflip", yflip)
+        init("length", float(length))
+        init("height", float(height))
+        init("lift", float(lift))
+        init("color", color)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'Elements are immutable, cannot set "{name}"')
 
     @property
     def ypos(self):
@@ -176,30 +668,96 @@ class Element:
         return Element(self.curve, [1 - c for c in self.clicks][::-1], not self.xflip, self.yflip, self.length, 
                        self.height, self.lift, self.color)
 
+    def _muted(self, muting_color=None, muting_curve=None):
+        """Whether the element is silenced by the muting color or curve"""
+        return self.color == muting_color or self.curve == muting_curve
+
     @property
-    def f(self):
-        """Returns the active curve, given the flip setting"""
+    def variant(self):
+        """str: Name of the active curve variant, given the flip setting"""
         if self.yflip:
             if self.xflip:
-                return self.curve.inverse
-            return self.curve.backward
+                return "inverse"
+            return "backward"
         elif self.xflip:
-            return self.curve.reverse
-        return self.curve.forward
+            return "reverse"
+        return "forward"
+
+    @property
+    def f(self):
+        """Returns the active curve, given the flip setting"""
+        return getattr(self.curve, self.variant)
 
     def copy(self):
         """Returns a copy of the element"""
         return Element(self.curve, self.clicks, self.xflip, self.yflip, 
                                     self.length, self.height, self.lift, self.color)
 
+    def _played(self):
+        """
+        Returns the element whose forward playback is the playback of this 
+        element read back to front, i.e. itself if it plays forward and 
+        otherwise the element with both flips set.
+        """
+        if self.forward:
+            return self
+        return Element(self.curve, self.clicks, True, True, self.length, 
+                       self.height, self.lift, self.color)
+
+    def _render(self, store, out=None, grain=50, muting_color=None, 
+                muting_curve=None, mode="grain"):
+        """
+        Warp a window of a sample along the element curve (without clicks)
+
+        Parameters
+        ----------
+        store : SampleStore
+            The sample to be used
+        out : numpy.ndarray
+            Optional preallocated buffer of shape (frames, channels) to write 
+            to. Its length sets the duration, which otherwise is the length of 
+            the element times the length of the sample.
+        grain : int
+            The number of sample slices for each of which a new speed is calculated
+        mode : str
+            "grain" to play each sample slice at its own constant speed, or 
+            "continuous" to read the sample at the curve position of every 
+            output frame.
+        """
+        if not mode in ["grain", "continuous"]:
+            raise ValueError(f'Unknown render mode: "{mode}"')
+        backward = True if not self.forward else False
+        el = self._played()
+        if out is None:
+            out = np.empty((round(el.length * len(store)), store.channels), 
+                           dtype=np.float32)
+        frames = len(out)
+        window = store.window(el.lift, el.height)
+        if el._muted(muting_color, muting_curve) or not len(window):
+            out[:] = 0
+            return out
+        if mode == "continuous":
+            positions = self.f(np.linspace(0, 1, frames)) * (len(window) - 1)
+            return _interpolate(window, positions, out=out)
+        width = int(np.ceil(len(window) / grain))
+        xcuts = _warp_map(el.curve, el.variant, grain)
+        # map every output frame to its position within its slice of the sample
+        slice_starts = np.minimum(np.arange(grain + 1) * width, len(window))
+        positions = np.interp(np.arange(frames), np.multiply(xcuts, frames), 
+                              slice_starts)
+        if backward:
+            positions = positions[::-1]
+        return _interpolate(window, positions, out=out)
+
     def audio(self, sample, grain=50, click_ms=60, fade_ms=10, 
-              muting_color=None, muting_curve=None):
+              muting_color=None, muting_curve=None, engine="numpy", 
+              mode="grain"):
         """
         Calculate AudioSegment from element data
 
         Parameters
         ----------
-        sample : AudioSegment
+        sample : SampleStore or AudioSegment
             The sample to be used
         grain : int
             The number of sample slices for each of which a new speed is calculated
@@ -207,15 +765,30 @@ class Element:
             The duration of a click in milliseconds
         fade_ms: int
             Number of milliseconds by which clicks are faded in and out 
+        engine: str
+            "numpy" to warp the sample as one PCM array, or "pydub" to warp 
+            and join AudioSegment slices.
+        mode: str
+            "grain" to play each of the grain sample slices at its own speed, 
+            or "continuous" to read the sample at the curve position of every
+            frame (numpy engine only).
         """
-        el = self
-        backward = True if not el.forward else False # important, reused later when el has changed!!!
-        if backward:
-            el = el.copy()
-            if el.yflip:
-                el.xflip = True
-            else:
-                el.yflip = True
+        if engine == "numpy":
+            sample = as_store(sample)
+            pcm = self._render(sample, grain=grain, 
+                muting_color=muting_color, muting_curve=muting_curve, 
+                mode=mode)
+            pcm *= _click_envelope([(0, len(pcm), self.clicks)], len(pcm), 
+                sample.frame_rate, click_ms, fade_ms)[:, None]
+            return _to_segment(pcm, sample.frame_rate, sample.sample_width)
+        if not engine == "pydub":
+            raise ValueError(f'Unknown audio engine: "{engine}"')
+        if not mode == "grain":
+            raise ValueError('The pydub engine only supports the "grain" mode.')
+        if isinstance(sample, SampleStore):
+            sample = sample.segment()
+        backward = True if not self.forward else False
+        el = self._played()
         old_duration = el.length * len(sample)
         if el.color == muting_color or el.curve == muting_curve:
             return AudioSegment.silent(duration=old_duration)
@@ -224,9 +797,7 @@ class Element:
         sample = sample[start:stop]
         width = np.ceil(len(sample) / grain)
         slices = [sample[width * i: width * (i + 1)] for i in range(grain)] 
-        ycuts = np.linspace(start=0, stop=1, num=grain + 1)
-        xcuts = [_findx(y, el.f) for y in ycuts[1:-1]] # exclude first and last points, since their x are 0 and 1
-        xcuts = [0] + xcuts + [1] # give them points back
+        xcuts = _warp_map(el.curve, el.variant, grain)
         new_durations = [b - a for a, b in _pairwise(xcuts)]
         scratch = sum(_milliseconds(s, d * old_duration) 
                                 for s, d in zip(slices, new_durations))
@@ -248,7 +819,8 @@ class Element:
 
 class Scratch:
     """
-    A class to combine and transform scratch elements.
+    A class to combine and transform scratch elements (immutable, like its 
+    elements).
     """
 
     def __init__(self, elements):
@@ -273,75 +845,206 @@ class Scratch:
 
         ...
 
+        The elements are stored as `Columns` of arrays. The transforms (/, 
+        //, **, - and ~) are lazy: they only accumulate into a pending 
+        transform of the columns, which is applied once (vectorized), when 
+        the columns are needed. Concatenation, repetition and (contiguous) 
+        slicing are lazy as well: they return ropes of their parts, which 
+        are only flattened into columns when these are needed.
         """
-        self.elements = list(elements)
-        self.length = sum(i.length for i in self.elements)
-        self.height = max(i.height + i.lift for i in self.elements)
-        self.lift = min(i.lift for i in self.elements)
-    
+        self._init(_to_columns(list(elements)))
+
+    def _init(self, base, length=None, height=None, lift=None):
+        init = super().__setattr__
+        init("_base", base)
+        init("_pending", None)
+        init("_period", None)
+        init("_motions", {}) # by rate and click
+        if isinstance(base, _Rope):
+            init("_columns", None)
+            init("_count", sum(len(part) for part in base.parts))
+            init("length", length)
+            init("height", height)
+            init("lift", lift)
+            return
+        init("_columns", base)
+        init("_count", len(base.length))
+        init("length", float(base.length.sum()) if length is None else length)
+        init("height", float((base.height + base.lift).max()) 
+                       if height is None else height)
+        init("lift", float(base.lift.min()) if lift is None else lift)
+
+    @classmethod
+    def _from_columns(cls, columns, length=None, height=None, lift=None):
+        """
+        Returns the scratch of columns (whose length, height and lift are 
+        computed unless given)
+        """
+        scratch = cls.__new__(cls)
+        scratch._init(columns, length, height, lift)
+        return scratch
+
+    @classmethod
+    def _from_parts(cls, parts):
+        """Returns the (lazy) concatenation of a tuple of scratches"""
+        scratch = cls.__new__(cls)
+        scratch._init(_Rope(parts), sum(part.length for part in parts), 
+            max(part.height for part in parts), min(part.lift for part in parts))
+        return scratch
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'Scratches are immutable, cannot set "{name}"')
+
+    def __len__(self):
+        """The number of elements"""
+        return self._count
+
+    @property
+    def columns(self):
+        """Columns: The elements as arrays, with all transforms applied"""
+        if self._columns is None:
+            base = self._base
+            if isinstance(base, _Rope):
+                base = base.columns
+            if self._pending is not None:
+                base = _transform(base, *self._pending)
+            super().__setattr__("_columns", base)
+        return self._columns
+
+    @property
+    def elements(self):
+        """tuple: Views of the elements (created on every access)"""
+        return _to_elements(self.columns)
+
+    def _transformed(self, xscale=1., yscale=1., yshift=0., reverse=False, 
+                     length=None):
+        """
+        Returns a scratch with one more transform pending: lengths scaled by 
+        xscale, every y mapped to yscale * y + yshift (mirrored if yscale is 
+        negative) and the order reversed if reverse. The length of the 
+        scratch is set to length if given (which xscale only approximates).
+        """
+        top = yscale * self.height + yshift
+        bottom = yscale * self.lift + yshift
+        scratch = Scratch.__new__(Scratch)
+        init = super(Scratch, scratch).__setattr__
+        init("_columns", None)
+        init("_base", self._base)
+        init("_count", self._count)
+        init("_pending", _compose(self._pending, 
+                                  (xscale, yscale, yshift, reverse)))
+        init("_period", self._period) # transforms apply to all elements alike
+        init("_motions", {})
+        init("length", self.length * xscale if length is None else length)
+        init("height", max(top, bottom))
+        init("lift", min(top, bottom))
+        return scratch
+
+    @property
+    def beats(self):
+        """int: Number of (started) beats of the scratch"""
+        return int(np.ceil(round(self.length, 9))) # ignore rounding errors
+
+    @property
+    def period(self):
+        """int: Number of elements after which the scratch repeats itself"""
+        if self._period is None:
+            super().__setattr__("_period", self._find_period())
+        return self._period
+
+    def _find_period(self):
+        """Returns the smallest number of elements that the scratch repeats"""
+        columns = self.columns
+        counts = np.diff(columns.offsets)
+        repeats = lambda column, n: np.array_equal(
+            column, np.tile(column[:n], len(column) // n if n else 0))
+        for n in range(1, len(self)):
+            if len(self) % n == 0 and all(repeats(column, n) 
+                for column in columns[:7] + (counts,)) and repeats(
+                columns.clicks, columns.offsets[n]):
+                return n
+        return len(self)
+
     def __getitem__(self, so):
         """Slice the scratch."""
         if isinstance(so, slicetype): # slicetype to avoid namespace conflict
-            elements = self.elements[so]
+            index = range(len(self))[so]
         elif isinstance(so, int):
-            elements = [self.elements[so]]
+            start = range(len(self))[so]
+            index = range(start, start + 1)
         else:
             message = f'Indexing must be of the form "[n]" or "[n:m]", where n and m are integers.'
             raise TypeError(message)
-        return Scratch(elements)
+        if (index and index.step == 1 and self._pending is None 
+            and isinstance(self._base, _Rope) and self._base._columns is None):
+            return self._slice_parts(index.start, index.stop)
+        return Scratch._from_columns(_take(self.columns, np.array(index, dtype=np.intp)))
+
+    def _slice_parts(self, start, stop):
+        """
+        Returns the elements from start to stop of a rope as a rope of its 
+        parts, only slicing the parts at either end (which `_leaves` never
+        returns as unflattened ropes, so slicing them does not recurse).
+        """
+        parts = []
+        first = 0
+        for part in _leaves(self._base.parts):
+            last = first + len(part)
+            if first >= start and last <= stop:
+                parts.append(part)
+            elif last > start:
+                parts.append(part[max(start - first, 0):stop - first])
+            first = last
+            if first >= stop:
+                break
+        return parts[0] if len(parts) == 1 else Scratch._from_parts(tuple(parts))
     
     def __add__(self, other):
         """Add two scratches."""
         if not isinstance(other, Scratch):
             message = "A scratch can only be added to another scratch."
             raise TypeError(message)
-        return Scratch(self.elements + other.elements)
+        return Scratch._from_parts((self, other))
     
     def __mul__(self, n):
         """Repeat a scratch n times."""
         if not isinstance(n, int) or (isinstance(n, int) and n < 1):
             message = "A scratch can only be multiplied by an integer > 0."
             raise ValueError(message)
-        scratch = self
-        for i in range(n-1):
-            scratch += self
-        return scratch
+        return Scratch._from_parts((self,) * n)
     
     def __mod__(self, n):
         """phase shift the scratch"""
         if not isinstance(n, int) or (
-            isinstance(n, int) and n > len(self.elements)):
-            message = "Phase shifting requires an integer smaller or equal to the number of elements. Here:" + str(len(self.elements))
+            isinstance(n, int) and n > len(self)):
+            message = "Phase shifting requires an integer smaller or equal to the number of elements. Here:" + str(len(self))
             raise ValueError(message)
         return self[n:] + self[:n]
 
     def __truediv__(self, n):
         """Set the length of the scratch."""
-        return Scratch([
-            el / (el.length / self.length * n) for el in self.elements])
+        xscale = 1 / self.length * n
+        return self._transformed(xscale=xscale, length=float(n))
 
     def __floordiv__(self, n):
         """Set the height of the scratch."""
-        return Scratch([
-            (el // (el.height / self.height * n) ) 
-            ** (el.lift / self.height * n)
-            for el in self.elements])
+        return self._transformed(yscale=1 / self.height * n)
     
     def __pow__(self, n):
         """Lift the scratch up or down the y-axis."""
-        return Scratch([el ** (el.lift + n) for el in self.elements])
+        return self._transformed(yshift=0. + n)
 
     def __neg__(self):
         """Flip the scratch along the y-axis."""
-        return Scratch([-el ** (self.lift + 
-            (self.height - (el.height + el.lift))) for el in self.elements])
+        return self._transformed(yscale=-1., yshift=self.lift + self.height)
 
     def __invert__(self):
         """Flip the scratch along the x-axis."""
-        return Scratch([~el for el in self.elements][::-1])
+        return self._transformed(reverse=True)
 
     def audio(self, sample, bpm=90, instrumental=None, num_beats=4,
-              muting_color=None, muting_curve=None):
+              muting_color=None, muting_curve=None, engine="numpy", 
+              mode="grain", single_pass=True, quality="full"):
         """
         Calculate AudioSegment from scratch data
         
@@ -349,23 +1052,50 @@ class Scratch:
         ----------
         bpm: int
             The number of beats per minute.
-        sample: AudioSegment
+        sample: SampleStore or AudioSegment
             The scratch sample to be used.
-        instrumental: AudioSegment
+        instrumental: SampleStore or AudioSegment
             The beat sample to be used.
         num_beats: int
             The length of the instrumental in number of beats.
             Only relevant if beat is provided
+        engine: str
+            "numpy" to render into one PCM buffer, or "pydub" to render and
+            join AudioSegments.
+        mode: str
+            "grain" or "continuous", see `Element.audio` (numpy engine only).
+        single_pass: bool
+            Whether to render each element directly at its duration at bpm 
+            (numpy engine only), instead of rendering at the speed of the
+            sample and rescaling the whole scratch to bpm afterwards. 
+        quality: str
+            A key of `QUALITIES`: "full" renders at the frame rate and channels
+            of the sample, "draft" renders mono at a reduced frame rate and 
+            (in the "grain" mode) with fewer grains, for quick auditioning.
         """
+        sample, grain = _for_quality(sample, quality)
+        if engine == "numpy":
+            return _to_segment(self._pcm(sample=sample, bpm=bpm, 
+                instrumental=instrumental, num_beats=num_beats, 
+                muting_color=muting_color, muting_curve=muting_curve, 
+                mode=mode, single_pass=single_pass, grain=grain), 
+                sample.frame_rate, sample.sample_width)
+        if not engine == "pydub":
+            raise ValueError(f'Unknown audio engine: "{engine}"')
+        if not mode == "grain":
+            raise ValueError('The pydub engine only supports the "grain" mode.')
         # ms_scratch = self.length / (bpm / 60) * 1000
         ms_scratch = self.length * 60000 / bpm
+        sample = sample.segment() # join AudioSegments from here on
         scratch = _milliseconds(sum(
-            i.audio(sample=sample, muting_color=muting_color, 
-                muting_curve=muting_curve) 
+            i.audio(sample=sample, grain=grain, muting_color=muting_color, 
+                muting_curve=muting_curve, engine=engine) 
             for i in self.elements), ms_scratch)
         if not instrumental:
             return scratch
-        target_beats = int(np.ceil(self.length)) # num of beats to fit the scratch into
+        if isinstance(instrumental, SampleStore):
+            instrumental = instrumental.segment()
+        target_beats = self.beats # num of beats to fit the scratch into
         ms_beat = len(instrumental) / num_beats
         if num_beats > target_beats:
             instrumental = instrumental[:(target_beats - num_beats) * ms_beat]
@@ -374,6 +1104,120 @@ class Scratch:
             instrumental = instrumental * (int(target_beats / num_beats)) + instrumental[:(target_beats % num_beats) * ms_beat]
         ms_instrumental = target_beats * 60000 / bpm
         return _milliseconds(instrumental, ms_instrumental).overlay(scratch)
+
+    def wav(self, sample, quality="full", **kwargs):
+        """
+        Calculate the bytes of a wav file from scratch data
+
+        Takes the same parameters as `audio` (numpy engine), but skips the 
+        AudioSegment.
+        """
+        sample, grain = _for_quality(sample, quality)
+        return _to_wav(self._pcm(sample, grain=grain, **kwargs), 
+            sample.frame_rate, sample.sample_width)
+
+    def blocks(self, sample, bpm=90, instrumental=None, num_beats=4,
+               muting_color=None, muting_curve=None, mode="grain", grain=50,
+               block_frames=8192):
+        """
+        Render the scratch element by element and yield it (with the 
+        instrumental mixed in) as float arrays of shape (block_frames, 
+        channels); the last block may be shorter.
+
+        Takes the same parameters as `audio` (numpy engine, single pass, 
+        without quality), plus:
+
+        grain : int
+            The number of sample slices for each of which a new speed is 
+            calculated (grain mode only).
+        block_frames: int
+            The number of frames per block.
+        """
+        sample = as_store(sample)
+        frames_per_beat = 60 * sample.frame_rate / bpm
+        def elements():
+            for el in self.elements:
+                out = np.empty((round(el.length * frames_per_beat), 
+                    sample.channels), dtype=np.float32)
+                _render_cached(el, sample, out=out, grain=grain,
+                    muting_color=muting_color, muting_curve=muting_curve, 
+                    mode=mode)
+                out *= _click_envelope([(0, len(out), el.clicks)], len(out), 
+                    sample.frame_rate)[:, None]
+                yield out
+        if not instrumental:
+            yield from _blocks(elements(), block_frames, sample.channels)
+            return
+        target_beats = self.beats # num of beats to fit the scratch into
+        beat = _fit_instrumental(instrumental, num_beats, target_beats, bpm, 
+            sample.frame_rate, sample.channels)
+        pos = 0
+        for block in _blocks(elements(), block_frames, sample.channels):
+            block = block[:len(beat) - pos] # the instrumental sets the length
+            if not len(block):
+                break
+            block += beat[pos:pos + len(block)]
+            pos += len(block)
+            yield block
+        for start in range(pos, len(beat), block_frames):
+            yield beat[start:start + block_frames].astype(np.float32)
+
+    def stream_wav(self, sample, quality="full", **kwargs):
+        """
+        Returns a generator of the bytes of a wav file from scratch data: first
+        the header, then one chunk of PCM data per block.
+
+        Takes the same parameters as `blocks`, plus the quality of `audio`.
+        """
+        sample, kwargs["grain"] = _for_quality(sample, quality) # fail early
+        frames_per_beat = 60 * sample.frame_rate / kwargs.get("bpm", 90)
+        if kwargs.get("instrumental"):
+            frames = round(self.beats * frames_per_beat)
+        else:
+            frames = sum(round(el.length * frames_per_beat) 
+                         for el in self.elements)
+        def chunks():
+            yield _wav_header(frames, sample.channels, sample.sample_width, 
+                              sample.frame_rate)
+            for block in self.blocks(sample, **kwargs):
+                yield _to_pcm(block, sample.sample_width).tobytes()
+        return chunks()
+
+    def _pcm(self, sample, bpm=90, instrumental=None, num_beats=4,
+             muting_color=None, muting_curve=None, mode="grain", 
+             single_pass=True, grain=50):
+        """
+        Render the scratch (and instrumental) into one float array of shape
+        (frames, channels) at the frame rate of the sample.
+        """
+        sample = as_store(sample)
+        frames_per_beat = 60 * sample.frame_rate / bpm
+        # either render at the final tempo or at sample speed and fit later
+        frames_per_length = frames_per_beat if single_pass else len(sample)
+        # render repeats only once, without views of the other elements
+        period = _to_elements(_take(self.columns, np.arange(self.period)))
+        frames = [round(el.length * frames_per_length) for el in period]
+        scratch = np.empty((sum(frames), sample.channels), dtype=np.float32)
+        bounds = list(zip(np.cumsum([0] + frames), np.cumsum(frames)))
+        for el, (start, stop) in zip(period, bounds):
+            _render_cached(el, sample, out=scratch[start:stop], 
+                grain=grain, muting_color=muting_color, 
+                muting_curve=muting_curve, mode=mode)
+        scratch *= _click_envelope(
+            [(start, stop, el.clicks) 
+             for el, (start, stop) in zip(period, bounds)],
+            len(scratch), sample.frame_rate)[:, None]
+        scratch = np.tile(scratch, (len(self) // len(period), 1))
+        if not single_pass:
+            scratch = _resample(scratch, round(self.length * frames_per_beat))
+        if not instrumental:
+            return scratch
+        target_beats = self.beats # num of beats to fit the scratch into
+        beat = _fit_instrumental(instrumental, num_beats, target_beats, bpm, 
+            sample.frame_rate, sample.channels).astype(np.float32)
+        n = min(len(beat), len(scratch))
+        beat[:n] += scratch[:n]
+        return beat
         
     def TTM(self, ppb=100, size=2):
         """
@@ -385,60 +1229,51 @@ class Scratch:
         ppb : int
                 The resolution of the graph in terms of the number of points per beat.
         """
-        beats = int(np.ceil(self.length))
-        self.fig = Figure()
-        self.fig.set_size_inches(beats * size, size)
-        self.ax = self.fig.add_subplot(111)
-        self.ax.cla()
-        self.ax.grid(which='major', color='#2e2d2d', linewidth=0.8)
-        self.ax.grid(which='minor', color='#787878', linestyle=':', linewidth=0.5)
-        self.ax.xaxis.set_major_locator(plt.MaxNLocator(1))
-        self.ax.minorticks_on()
+        beats = self.beats
+        fig = Figure()
+        fig.set_size_inches(beats * size, size)
+        ax = fig.add_subplot(111)
+        ax.cla()
+        ax.grid(which='major', color='#2e2d2d', linewidth=0.8)
+        ax.grid(which='minor', color='#787878', linestyle=':', linewidth=0.5)
+        ax.xaxis.set_major_locator(plt.MaxNLocator(1))
+        ax.minorticks_on()
         margin = .1
-        self.ax.set_xlim(0 - margin, beats + margin)
-        self.ax.set_ylim(0 - margin, 1 + margin)
-        self.ax.set_xlabel('Beats')
-        self.ax.set_xticks(np.linspace(0, beats, beats + 1), [i for i in range(1,beats + 1)] + [""])
-        self.ax.set_ylabel('Sample')
-        self.ax.set_yticks([0,1], ["", ""])
-        ax2 = self.ax.twinx()
+        ax.set_xlim(0 - margin, beats + margin)
+        ax.set_ylim(0 - margin, 1 + margin)
+        ax.set_xlabel('Beats')
+        ax.set_xticks(np.linspace(0, beats, beats + 1), [i for i in range(1,beats + 1)] + [""])
+        ax.set_ylabel('Sample')
+        ax.set_yticks([0,1], ["", ""])
+        ax2 = ax.twinx()
         ax2.set_ylabel('Sample')
         ax2.set_yticks([0,1], ["", ""])
         strangescalar = .82
-        for i in range(beats):
-            if i % 4 == 0:
-                self.ax.axvline(x=i, color='black')
-            if not i % 2 == 0:
-                self.ax.axvspan(i, 1 + i, facecolor='#e6e6e6', alpha=0.5,
-                    ymin=1 - margin * strangescalar, 
-                    ymax=margin * strangescalar)
-            else:
-                self.ax.axvspan(i, 1 + i, facecolor='#cccc', alpha=0.5, 
-                    ymin=1 - margin * strangescalar, 
-                    ymax=margin * strangescalar) 
-        start = 0 
-        for el in self.elements:
-            f = el.curve.forward
-            if el.yflip:
-                f = el.curve.backward
-                if el.xflip:
-                    f = el.curve.inverse
-            elif el.xflip:
-                f = el.curve.reverse                
-            num = round(el.length * ppb) + 1
-            x_norm = np.linspace(start=0, stop=1, num=num) # normalized
-            # y_crv = f(x_norm)
-            y_crv = f(x_norm) * el.height + el.lift
-            x_crv = np.linspace(start=start, stop=start+el.length, num=num) # scaled
-            self.ax.plot(x_crv, y_crv, color=el.color, linewidth=3)
-            for click in el.clicks:
-                x_click = click * el.length + start
-                y_click = np.interp(x_click, x_crv, y_crv) # get y from interpolation
-                self.ax.plot(x_click, y_click, marker="o", markersize=8, 
-                    markeredgecolor="black", markeredgewidth=1, 
-                    markerfacecolor="white")
-            start += el.length
-        return self.fig
+        for i in range(0, beats, 4):
+            ax.axvline(x=i, color='black')
+        bottom, top = margin * strangescalar, 1 - margin * strangescalar
+        ax.add_collection(PatchCollection( # x in beats, y relative to the axes
+            [Rectangle((i, bottom), 1, top - bottom) for i in range(beats)],
+            facecolors=['#cccc' if i % 2 == 0 else '#e6e6e6' 
+                        for i in range(beats)], 
+            edgecolors="none", alpha=0.5, transform=ax.get_xaxis_transform()),
+            autolim=False)
+        self._draw(ax, ppb, markersize=8)
+        return fig
+
+    def TTM_svg(self, ppb=100, size=2):
+        """
+        Returns the TTM of the scratch as the text of an svg file, written 
+        directly instead of through a matplotlib figure (see `TTM`).
+
+        Parameters
+        ----------
+        ppb : int
+            The resolution of the graph in terms of the number of points per beat.
+        size : float
+            The height of the graph (and width of a beat) in inches.
+        """
+        return ttm_svg(self, ppb, size)
 
     def preview(self, ppb=50):
         """
@@ -449,35 +1284,98 @@ class Scratch:
         ppb : int
             The resolution of the graph in terms of the number of points per beat.
         """
-        beats = int(np.ceil(self.length))
-        self.fig = Figure()
-        self.fig.set_size_inches(beats * 1, .75)
-        self.ax = self.fig.add_subplot(111)
-        self.ax.tick_params(left=False, right=False, labelleft=False, 
+        beats = self.beats
+        fig = Figure()
+        fig.set_size_inches(beats * 1, .75)
+        ax = fig.add_subplot(111)
+        ax.tick_params(left=False, right=False, labelleft=False, 
             labelbottom=False, bottom=False)
-        self.ax.cla()
-        start = 0 
-        for el in self.elements:
-            f = el.curve.forward
-            if el.yflip:
-                f = el.curve.backward
-                if el.xflip:
-                    f = el.curve.inverse
-            elif el.xflip:
-                f = el.curve.reverse                
-            num = round(el.length * ppb) + 1
-            x_norm = np.linspace(start=0, stop=1, num=num) # normalized
-            y_crv = f(x_norm) * el.height + el.lift
-            x_crv = np.linspace(start=start, stop=start+el.length, num=num) # scaled
-            self.ax.plot(x_crv, y_crv, color=el.color, linewidth=3)
-            for click in el.clicks:
-                x_click = click * el.length + start
-                y_click = np.interp(x_click, x_crv, y_crv) # get y from interpolation
-                self.ax.plot(x_click, y_click, marker="o", markersize=5, 
-                    markeredgecolor="black", markeredgewidth=1, 
-                    markerfacecolor="white")
-            start += el.length
-            self.fig.patch.set_facecolor((0, 0, 0, 0.125))
-            self.ax.margins(x=0)
-            self.ax.set_axis_off()
-        return self.fig
\ No newline at end of file
+        ax.cla()
+        self._draw(ax, ppb, markersize=5)
+        ax.autoscale_view()
+        fig.patch.set_facecolor((0, 0, 0, 0.125))
+        ax.margins(x=0)
+        ax.set_axis_off()
+        return fig
+
+    def sample(self, rate=100, click=0., cache=True):
+        """
+        Returns the (cached) Motion of the scratch: time, platter position 
+        and fader state as arrays over the whole scratch, computed in one
+        pass over its columns (and only for a repeated period once).
+
+        Parameters
+        ----------
+        rate : int
+            The resolution in terms of the number of points per beat.
+        click : float
+            The duration of a click in beats, for the fader state. With the
+            default of 0, the fader is only closed at points right on a click.
+        cache : bool
+            Whether to keep the motion on the scratch. Only the few fixed 
+            rates of the drawings should be cached, since a scratch (e.g. of
+            a codebook name) can live as long as the process.
+        """
+        motion = self._motions.get((rate, click))
+        if motion is None:
+            period = self.period
+            columns = _take(self.columns, np.arange(period))
+            motion = _sample(columns, rate, click)
+            if len(self) > period:
+                motion = _repeat(motion, len(self) // period, 
+                                 float(columns.length.sum()))
+            for array in motion:
+                array.flags.writeable = False # shared between callers
+            if cache:
+                self._motions[(rate, click)] = motion
+        return motion
+
+    def export_motion(self, rate=100, click=0., format="csv"):
+        """
+        Returns the sampled motion of the scratch as the bytes of a file
+        (without caching the motion, whose rate is up to the caller).
+
+        Parameters
+        ----------
+        rate, click : 
+            See `sample`.
+        format : str
+            "csv" for time, position and fader columns, or "npz" for all 
+            arrays of the Motion.
+        """
+        motion = self.sample(rate, click, cache=False)
+        file = io.BytesIO()
+        if format == "csv":
+            np.savetxt(file, np.column_stack(motion[:3]), 
+                fmt=["%.6f", "%.6f", "%d"], delimiter=",", 
+                header="time,position,fader", comments="")
+        elif format == "npz":
+            np.savez(file, **motion._asdict())
+        else:
+            raise ValueError(f'Unknown motion format: "{format}"')
+        return file.getvalue()
+
+    def _draw(self, ax, ppb, markersize):
+        """
+        Draws the curves of all elements as one LineCollection and all clicks
+        as one scatter (instead of a line per element and click). The clicks
+        are thus drawn on top of all curves, including later (e.g. white 
+        ghost) curves, which used to cover them.
+
+        Parameters
+        ----------
+        ax : matplotlib.axes.Axes
+            The axes to draw on.
+        ppb : int
+            The resolution in terms of the number of points per beat.
+        markersize : float
+            The diameter of the click markers in points.
+        """
+        motion = self.sample(ppb)
+        points = np.column_stack((motion.time, motion.position))
+        ax.add_collection(LineCollection(
+            np.split(points, motion.offsets[1:-1]), colors=self.columns.color, 
+            linewidths=3, capstyle="projecting", joinstyle="round", zorder=2))
+        ax.scatter(motion.click_time, motion.click_position, 
+            s=markersize ** 2, marker="o", facecolors="white", 
+            edgecolors="black", linewidths=1, zorder=2)
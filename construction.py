@@ -1,26 +1,44 @@
+import hashlib
 import re
+from cache import LRUCache
 from classes import Curve, Element, Scratch
+from formulas import Name, evaluate, names, parse, unparse
 import numpy as np
 
 
 ### Curves
 ##############################################################################
 
+def _tabulated_inverse(f, num=16385):
+    """Numerical inverse of a strictly increasing f by interpolating a table"""
+    x = np.linspace(0, 1, num)
+    with np.errstate(divide="ignore"):
+        y = f(x)
+    return lambda y_: np.interp(y_, y, x)
+
 L = Curve(lambda x: np.zeros(len(x)))
 
-S = Curve(lambda x: (-np.cos(x * np.pi) + 1) / 2)
+S = Curve(lambda x: (-np.cos(x * np.pi) + 1) / 2, 
+          finv=lambda y: np.arccos(1 - 2 * y) / np.pi)
 
 SLogScaler = -1 
-SLog = Curve(lambda x: (0.5 + np.sin(x * np.pi - np.pi / 2) / 2) ** ((2 * (1 - x)) ** SLogScaler))
+_slog = lambda x: (0.5 + np.sin(x * np.pi - np.pi / 2) / 2) ** ((2 * (1 - x)) ** SLogScaler)
+SLog = Curve(_slog, finv=_tabulated_inverse(_slog))
 
 SExScaler = 1
-SEx = Curve(lambda x: (0.5 + np.sin(x * np.pi - np.pi / 2) / 2) ** ((2 * (1 - x)) ** SExScaler))
+_sex = lambda x: (0.5 + np.sin(x * np.pi - np.pi / 2) / 2) ** ((2 * (1 - x)) ** SExScaler)
+SEx = Curve(_sex, finv=_tabulated_inverse(_sex))
 
 ExScaler = 10
-Ex = Curve(lambda x: (np.exp(ExScaler * x) - 1) / (np.exp(ExScaler) - 1))
+Ex = Curve(lambda x: (np.exp(ExScaler * x) - 1) / (np.exp(ExScaler) - 1),
+           finv=lambda y: np.log(y * (np.exp(ExScaler) - 1) + 1) / ExScaler)
 
 LogScaler = 100
-Log = Curve(lambda x: np.log(LogScaler * x + 1) / np.log(LogScaler + 1))
+Log = Curve(lambda x: np.log(LogScaler * x + 1) / np.log(LogScaler + 1),
+            finv=lambda y: (np.power(LogScaler + 1, y) - 1) / LogScaler)
+
+CURVES = {"L": L, "S": S, "SLog": SLog, "SEx": SEx, "Ex": Ex, "Log": Log}
+CURVE_NAMES = {curve: name for name, curve in CURVES.items()}
 
 
 ### Elementary scratch constructor
@@ -46,7 +64,7 @@ def fcl_strings(n, dasq):
     if dasq == "Q":
         return  [f'{i+1}/{n+3}' for i in range(1, n+1)]
 
-def make_elementary_scratch(name):
+def _compile_elementary():
     _h = "(?P<h>h(?:old)?)"
     _gh = "(?P<gh>g(?:host)?h(?:old)?)"
     _g = "(?P<g>g(?:host)?)"
@@ -65,13 +83,18 @@ def make_elementary_scratch(name):
     _Q = "(?P<Q>Q)"
     _Ex = "(?P<Ex>Ex)"
     _Log = "(?P<Log>Log)"
-    ELS = re.compile(fr"(?:{_h}|{_gh})$|(?:{_g}|{_b}|{_i}|{_o}|{_d}|(?:{_f}|{_if}|{_of}|{_df}|{_tr})(?:{_D}|{_A}|{_S}|{_Q})?)(?:{_Ex}|{_Log})?$")
+    return re.compile(fr"(?:{_h}|{_gh})$|(?:{_g}|{_b}|{_i}|{_o}|{_d}|(?:{_f}|{_if}|{_of}|{_df}|{_tr})(?:{_D}|{_A}|{_S}|{_Q})?)(?:{_Ex}|{_Log})?$")
+
+ELS = _compile_elementary()
+FLS = re.compile(r"(?:[iod]?f(?:lare)?(?P<fN>\d)|tr(?:ansformer)?(?P<trN>\d))(?P<DASQ>[DASQ])?")
+
+def _elementary_parts(name):
+    """Returns the curve name, click strings and color of an elementary name"""
     m = ELS.match(name)
     if not m:
         raise ValueError(f'unintelligible name: "{name}"')
     dic = m.groupdict()
     dic = {k:True if v else False for k,v in dic.items()}
-    l, h, ys = 1, 1, 0 # default
     crv, crvc = "S", "k" # default
     cl = [] # default
     if dic["h"]:
@@ -88,36 +111,46 @@ def make_elementary_scratch(name):
             crv = "Ex"
         if dic["i"] or dic["d"] or dic["if"] or dic["tr"] or dic["df"]:
             cl.append("0")
-        m = re.match(r"(?:[iod]?f(?:lare)?(?P<fN>\d)|tr(?:ansformer)?(?P<trN>\d))(?P<DASQ>[DASQ])?", name)
+        m = FLS.match(name)
         if m:
             md = m.groupdict()
             n = int(md["fN"]) if md["fN"] else int(md["trN"]) - 1
             cl += fcl_strings(int(n), md['DASQ'])
         if dic["o"] or dic["d"] or dic["of"] or dic["tr"] or dic["df"]:
             cl.append("1")
-        cl = f'[{", ".join(cl)}]'
+    return crv, cl, crvc
+
+def make_elementary_scratch(name):
+    crv, cl, crvc = _elementary_parts(name)
+    cl = f'[{", ".join(cl)}]'
     scratch = f"Scratch([Element(curve={crv}, clicks={cl}, xflip=False, yflip=False, length=1, height=1, lift=0, color='{crvc}')])"
     return scratch
 
+def _elementary(name):
+    """Makes the scratch of an elementary name"""
+    crv, cl, crvc = _elementary_parts(name)
+    clicks = [int(i.split("/")[0]) / int(i.split("/")[1]) if "/" in i 
+              else int(i) for i in cl]
+    return Scratch([Element(curve=CURVES[crv], clicks=clicks, xflip=False, 
+        yflip=False, length=1, height=1, lift=0, color=crvc)])
+
  
 ### Tear constructor
 ##############################################################################
 
-def tearParts(steps, el):
-    if int(steps) <= 1:
-        raise ValueError("Steps must be an int > 1")
-    return [
-        f"({el}/(1/{steps})//(1/{steps})){f'**({i}/{steps})' if not i==0 else ''}" 
-        for i in range(steps)]
-
-def tear_to_formula(name):
+def _compile_tear():
     _t = "(?P<t>((?P<ft>f)|(?P<trt>tr))?t(?:ear)?(?P<tN>\d))"
     _i = "(?P<i>i)"
     _o = "(?P<o>o)"
     _d = "(?P<d>d)"
     _iod = f"(?:{_i}|{_o}|{_d})"
     _crv = "(?P<crv>Ex|Log)"
-    TRS = re.compile(fr"{_iod}?{_t}{_crv}?(?:__(?P<el>(?:d?f(?:lare)?\d|tr(?:ansformer)?\d)[DASQ]?))?$")
+    return re.compile(fr"{_iod}?{_t}{_crv}?(?:__(?P<el>(?:d?f(?:lare)?\d|tr(?:ansformer)?\d)[DASQ]?))?$")
+
+TRS = _compile_tear()
+
+def _tear_elements(name):
+    """Returns the elementary names of the parts of a tear"""
     m = TRS.match(name)
     if not m or name.startswith("otr") or name.startswith("itr"):
         raise ValueError(f'unintelligible name: "{name}"')
@@ -129,53 +162,72 @@ def tear_to_formula(name):
             dic["el"] = f'd{dic["crv"] or ""}' 
         else:
             dic["el"] = f'b{dic["crv"] or ""}'    
-    parts = tearParts(int(dic['tN']) + 1, dic['el']) # <--- tN means N + 1 slices (like sounds in flares)
+    steps = int(dic['tN']) + 1 # <--- tN means N + 1 slices (like sounds in flares)
+    if steps <= 1:
+        raise ValueError("Steps must be an int > 1")
+    elements = [dic['el']] * steps
     # handle clicks between tear parts
     if dic["ft"] or dic["trt"]:
         if dic["el"].startswith("b"):
-            parts[0] = parts[0].replace("b", "o")
-            parts[-1] = parts[-1].replace("b", "i")
+            elements[0] = elements[0].replace("b", "o")
+            elements[-1] = elements[-1].replace("b", "i")
         elif dic["el"].startswith("f"):
-            parts[0] = parts[0].replace("f", "of")
-            parts[-1] = parts[-1].replace("f", "if")
-        for i in range(1, len(parts)-1):
+            elements[0] = elements[0].replace("f", "of")
+            elements[-1] = elements[-1].replace("f", "if")
+        for i in range(1, len(elements)-1):
             if dic["el"].startswith("b"):
-                parts[i] = parts[i].replace("b", "d")
+                elements[i] = elements[i].replace("b", "d")
             elif dic["el"].startswith("f"):
-                parts[i] = parts[i].replace(
+                elements[i] = elements[i].replace(
                     f'f{dic["el"][1]}', f'tr{int(dic["el"][1]) + 1}')          
     # handle iod clicks
-    elements = [re.sub(r"[-+*/%~\[\]\(\).:]|\b\d*\b", " ", i).strip() 
-        for i in parts]
     if (dic["i"] or dic["d"] or dic["trt"]) and not any(
         dic["el"].startswith(i) for i in ["i","d","tr"]):
         if elements[0].startswith("b"):
-            parts[0] = parts[0].replace("b", "i")
+            elements[0] = elements[0].replace("b", "i")
         elif elements[0].startswith("of"):
-            parts[0] = parts[0].replace(
+            elements[0] = elements[0].replace(
                 f'of{dic["el"][1]}', f'tr{int(dic["el"][1]) + 1}')
         elif elements[0].startswith("o"):
-            parts[0] = parts[0].replace("o", "d").replace("Ldg", "Log")            
+            elements[0] = elements[0].replace("o", "d").replace("Ldg", "Log")            
         elif elements[0].startswith("f"):
-            parts[0] = parts[0].replace("f", "if")
+            elements[0] = elements[0].replace("f", "if")
     if (dic["o"] or dic["d"] or dic["trt"]) and not any(
         dic["el"].startswith(i) for i in ["o","d","tr"]):
         if elements[-1].startswith("b"):
-            parts[-1] = parts[-1].replace("b", "o")
+            elements[-1] = elements[-1].replace("b", "o")
         elif elements[-1].startswith("if"):
-            parts[-1] = parts[-1].replace(
+            elements[-1] = elements[-1].replace(
                 f'if{dic["el"][1]}', f'tr{int(dic["el"][1]) + 1}')
         elif elements[-1].startswith("i"):
-            parts[-1] = parts[-1].replace("i", "d")            
+            elements[-1] = elements[-1].replace("i", "d")            
         elif elements[-1].startswith("f"):
-            parts[-1] = parts[-1].replace("f", "of")
-    # wrap up
-    elements = [re.sub(r"[-+*/%~\[\]\(\).:]|\b\d*\b", " ", i).strip() 
-        for i in parts]
-    element_dics = [make_elementary_scratch(el)[1] for el in elements]
+            elements[-1] = elements[-1].replace("f", "of")
+    for el in elements:
+        _elementary_parts(el) # raises for unintelligible parts
+    return elements
+
+def tear_to_formula(name):
+    elements = _tear_elements(name)
+    steps = len(elements)
+    parts = [
+        f"({el}/(1/{steps})//(1/{steps})){f'**({i}/{steps})' if not i==0 else ''}" 
+        for i, el in enumerate(elements)]
     formula = " + ".join(parts)
     return formula
 
+def _tear(name):
+    """Makes the scratch of a tear name, one elementary part per slice"""
+    elements = _tear_elements(name)
+    steps = len(elements)
+    scratch = None
+    for i, el in enumerate(elements):
+        part = _elementary(el) / (1 / steps) // (1 / steps)
+        if not i == 0:
+            part = part ** (i / steps)
+        scratch = part if scratch is None else scratch + part
+    return scratch
+
 ### Orbit constructor
 ##############################################################################
 
@@ -186,19 +238,43 @@ _tEl = "(?:__(?:[bd]|(?:f\d|tr\d)[DASQ]?))"
 ORB = re.compile(
     fr"(?P<L>{_s}{_c}?{_tEl}?)_(?P<R>{_s}{_c}?{_tEl}?)(?:_(?P<S>\d\d))?$")
 
-def orbit_to_formula(name):
+def _orbit_parts(name):
+    """
+    Returns the left and right names of an orbit, their shares of its length 
+    (or None if equal), and whether it is played at half height.
+    """
     m = ORB.match(name)
     if not m:
         raise ValueError(f'unintelligible name: "{name}"')
     dic = m.groupdict()
+    shares = None
     if dic['S']:
         num1, num2 = dic['S'][0], dic['S'][1]
         den = int(num1) + int(num2)
-        formula = f"({dic['L']}/({num1}/{den}) + -{dic['R']}/({num2}/{den})) / 1{' // 0.5' if not any(i.startswith(j) for i in [dic['L'], dic['R']] for j in ['f', 'if', 'of', 'tr']) else ''}"
+        shares = (int(num1), int(num2), den)
+    halve = not any(i.startswith(j) for i in [dic['L'], dic['R']] 
+                    for j in ['f', 'if', 'of', 'tr'])
+    return dic['L'], dic['R'], shares, halve
+
+def orbit_to_formula(name):
+    left, right, shares, halve = _orbit_parts(name)
+    if shares:
+        num1, num2, den = shares
+        formula = f"({left}/({num1}/{den}) + -{right}/({num2}/{den})) / 1{' // 0.5' if halve else ''}"
     else:
-        formula = f"({dic['L']} + -{dic['R']}) / 1{' // 0.5' if not any(i.startswith(j) for i in [dic['L'], dic['R']] for j in ['f', 'if', 'of', 'tr']) else ''}"
+        formula = f"({left} + -{right}) / 1{' // 0.5' if halve else ''}"
     return formula
 
+def _orbit(name):
+    """Makes the scratch of an orbit name from its elementary or tear sides"""
+    left, right, shares, halve = _orbit_parts(name)
+    left, right = resolve_name(left), -resolve_name(right)
+    if shares:
+        num1, num2, den = shares
+        left, right = left / (num1 / den), right / (num2 / den)
+    scratch = (left + right) / 1
+    return scratch // 0.5 if halve else scratch
+
 
 ### make_scratch constructor
 ##############################################################################
@@ -207,56 +283,154 @@ def names_in_formula(formula):
     formula = re.sub(r"[-+*/%~\[\]\(\).:]|\b\d*\b", " ", formula)
     return formula.split()
 
-def new(formula, codebook={}):
-    """Recursively yield all hiterto unknown scratch names from a function"""
-    for name in set(names_in_formula(formula)):
-        try:
-            exec(name)
-        except NameError:
-            try:
-                exec(make_elementary_scratch(name))
-                yield name
-            except:
-                yield name
-                try:
-                    for name in new(tear_to_formula(name), codebook):
-                        yield name
-                except:
-                    try:
-                        for name in new(orbit_to_formula(name), codebook):
-                            yield name
-                    except:
-                        for name in new(codebook[name], codebook):
-                            yield name
-
-# Avoid name space conflicts of python-incompatible scratch names
-SLICE = re.compile(r"\bslice\b")            
-IN = re.compile(r"\bin\b")
-IN_ = re.compile(r"\bin_(?=\w)")
-_IN = re.compile(r"(?<=\w)_in\b")        
+def classify(name, codebook={}):
+    """
+    Returns the kind of a scratch name: "elementary", "tear", "orbit" or 
+    "codebook". Raises KeyError for unknown names.
+    """
+    if ELS.match(name):
+        return "elementary"
+    m = TRS.match(name)
+    if m and int(m["tN"]) > 0 and not name.startswith(("otr", "itr")):
+        return "tear"
+    if ORB.match(name):
+        return "orbit"
+    if name in codebook:
+        return "codebook"
+    raise KeyError(name)
+
+CONSTRUCTORS = {"elementary": _elementary, "tear": _tear, "orbit": _orbit}
+
+SCRATCHES = LRUCache(maxsize=4096) # scratches of elementary, tear and orbit names
+
+def resolve_name(name):
+    """
+    Returns the (cached) scratch of an elementary, tear or orbit name. These
+    do not depend on the codebook, so their scratches are shared between all
+    calls (scratches are immutable). Raises KeyError for other names.
+    """
+    kind = classify(name)
+    return SCRATCHES.get_or_put(name, lambda: CONSTRUCTORS[kind](name))
+
+def _resolve(name, codebook, resolve):
+    """
+    Makes the scratch of a name, from the cache for elementary, tear and 
+    orbit names and from the formula of codebook names. Names within 
+    formulas are looked up with resolve.
+    """
+    if classify(name, codebook) == "codebook":
+        entry = codebook[name]
+        if isinstance(entry, Scratch): # precompiled
+            return entry
+        return evaluate(parse(entry), resolve)
+    return resolve_name(name)
 
 def make_scratch(formula, codebook={}):
-    """Make scratch given formula and codebook"""
-    formula = SLICE.sub("s", formula)
-    formula = IN.sub("i", formula)
-    formula = IN_.sub("i_", formula)
-    formula = _IN.sub("_i", formula)
-    just_defined = set()
-    for n in list(new(formula, codebook))[::-1]:
-        if n in just_defined:
-            continue
-        try:
-            exec(f"{n} = {make_elementary_scratch(n)}")
-            just_defined.add(n)
-        except:
-            try:
-                exec(f"{n} = {tear_to_formula(n)}")
-                just_defined.add(n)
-            except:
-                try:
-                    exec(f"{n} = {orbit_to_formula(n)}")
-                    just_defined.add(n)
-                except:
-                    exec(f"{n} = {codebook[n]}")
-                    just_defined.add(n)
-    return eval(formula)
\ No newline at end of file
+    """
+    Make scratch given formula and codebook (of formulas, or of scratches as 
+    returned by `compile_codebook`)
+    """
+    scratches = {} # every name is made only once
+    def resolve(name):
+        if not name in scratches:
+            scratches[name] = _resolve(name, codebook, resolve)
+        return scratches[name]
+    return evaluate(parse(formula), resolve)
+
+
+### Codebook compiler
+##############################################################################
+
+def _codebook_order(codebook):
+    """
+    Returns the names of a codebook in dependency order (every entry after
+    the entries its formula refers to). Raises ValueError for cycles.
+    """
+    dependencies = {
+        name: [n for n in names(parse(formula)) 
+               if n in codebook and classify(n, codebook) == "codebook"]
+        for name, formula in codebook.items()}
+    order, done, path = [], set(), []
+    def visit(name):
+        if name in done:
+            return
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            raise ValueError(f'Cyclic codebook entries: "{" -> ".join(cycle)}"')
+        path.append(name)
+        for dependency in dependencies[name]:
+            visit(dependency)
+        path.pop()
+        done.add(name)
+        order.append(name)
+    for name in codebook:
+        visit(name)
+    return order
+
+def compile_codebook(codebook):
+    """
+    Evaluates every entry of a codebook once, in dependency order, and 
+    returns a table of names to scratches for `make_scratch`, in which 
+    codebook names are mere lookups.
+
+    Parameters
+    ----------
+    codebook : dict
+        Scratch names and their formulas.
+    """
+    table = {}
+    def resolve(name):
+        if name in table:
+            return table[name]
+        return resolve_name(name) # raises KeyError for unknown names
+    for name in _codebook_order(codebook):
+        if classify(name, codebook) == "codebook":
+            table[name] = evaluate(parse(codebook[name]), resolve)
+    return table
+
+
+### Canonical formulas
+##############################################################################
+
+LONG_FORMS = re.compile(r"transformer|ghost|hold|baby|dice|flare|tear|out|in")
+SHORT_FORMS = {"transformer": "tr", "ghost": "g", "hold": "h", "baby": "b", 
+               "dice": "d", "flare": "f", "tear": "t", "out": "o", "in": "i"}
+
+def canonical_name(name, codebook={}):
+    """
+    Returns the shortest spelling of an elementary, tear or orbit name (e.g. 
+    "i" for "in", "f2" for "flare2"), and the canonical name a codebook alias 
+    stands for (e.g. "o_i" for "chirp").
+    """
+    if classify(name, codebook) == "codebook":
+        tree = parse(codebook[name])
+        if isinstance(tree, Name): # an alias
+            return canonical_name(tree.id, codebook)
+        return name
+    return LONG_FORMS.sub(lambda m: SHORT_FORMS[m.group()], name)
+
+def canonical(formula, codebook={}):
+    """
+    Returns the canonical spelling of a formula: aliases expanded, long 
+    names shortened, numbers written alike, single spaces around binary 
+    operators and no redundant parentheses.
+    """
+    def rename(tree):
+        if isinstance(tree, Name):
+            return Name(canonical_name(tree.id, codebook))
+        if isinstance(tree, tuple):
+            return type(tree)(*(rename(i) for i in tree))
+        return tree
+    return unparse(rename(parse(formula)))
+
+def fingerprint(scratch, digits=9):
+    """
+    Returns a stable hash of the elements of a scratch, the same for all 
+    formulas that make the same scratch (up to digits decimals), e.g. to key
+    caches of renders.
+    """
+    r = lambda x: round(x, digits) + 0. # + 0. turns -0. into 0.
+    elements = [(CURVE_NAMES[el.curve], tuple(r(i) for i in el.clicks), 
+                 el.xflip, el.yflip, r(el.length), r(el.height), r(el.lift), 
+                 el.color) for el in scratch.elements]
+    return hashlib.blake2b(repr(elements).encode(), digest_size=16).hexdigest()
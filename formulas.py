@@ -0,0 +1,240 @@
+"""
+`scratchbook.formulas` implements the following classes:
+`Name`, `Number`
+    The leaves of the expression tree of a formula.
+`UnaryOp`, `BinOp`, `Subscript`, `Slice`
+    The inner nodes of the expression tree of a formula.
+"""
+
+import operator
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from cache import LRUCache
+
+
+### Classes
+##############################################################################
+
+Name = namedtuple("Name", ["id"])
+Number = namedtuple("Number", ["value"])
+UnaryOp = namedtuple("UnaryOp", ["op", "operand"])
+BinOp = namedtuple("BinOp", ["op", "left", "right"])
+Subscript = namedtuple("Subscript", ["value", "index"])
+Slice = namedtuple("Slice", ["start", "stop", "step"])
+
+
+### Parser
+##############################################################################
+
+TOKEN = re.compile(r"\s*(?:(?P<number>\d+\.\d*|\.\d+|\d+)|(?P<name>[A-Za-z_]\w*)"
+                   r"|(?P<op>\*\*|//|[-+~*/%()\[\]:]))")
+
+def _tokenize(formula):
+    """Returns the (kind, text, position) tokens of a formula"""
+    tokens = []
+    pos = 0
+    formula = formula.rstrip()
+    while pos < len(formula):
+        m = TOKEN.match(formula, pos)
+        if not m:
+            raise SyntaxError(f'Unexpected "{formula[pos:].strip()[0]}" at '
+                              f'position {pos} of formula "{formula}"')
+        tokens.append((m.lastgroup, m.group(m.lastgroup), m.start(m.lastgroup)))
+        pos = m.end()
+    tokens.append(("end", "", len(formula)))
+    return tokens
+
+class _Parser:
+    """
+    Recursive descent parser following the precedence of the Python operators
+    (from lowest to highest):
+    `+ -` < `* / // %` < unary `- + ~` < `**` < slicing.
+    """
+
+    def __init__(self, formula):
+        self.formula = formula
+        self.tokens = _tokenize(formula)
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i][1]
+
+    def take(self, *texts):
+        """Consumes and returns the next token text if it is one of texts"""
+        if self.tokens[self.i][1] in texts and self.tokens[self.i][0] != "end":
+            self.i += 1
+            return self.tokens[self.i - 1][1]
+        return None
+
+    def expect(self, text):
+        if not self.take(text):
+            self.fail()
+
+    def fail(self):
+        kind, text, pos = self.tokens[self.i]
+        what = "end of formula" if kind == "end" else f'"{text}"'
+        raise SyntaxError(f'Unexpected {what} at position {pos} of formula '
+                          f'"{self.formula}"')
+
+    def parse(self):
+        tree = self.expr()
+        if self.tokens[self.i][0] != "end":
+            self.fail()
+        return tree
+
+    def expr(self):
+        tree = self.term()
+        while op := self.take("+", "-"):
+            tree = BinOp(op, tree, self.term())
+        return tree
+
+    def term(self):
+        tree = self.factor()
+        while op := self.take("*", "/", "//", "%"):
+            tree = BinOp(op, tree, self.factor())
+        return tree
+
+    def factor(self):
+        if op := self.take("-", "+", "~"):
+            return UnaryOp(op, self.factor())
+        return self.power()
+
+    def power(self):
+        tree = self.primary()
+        if self.take("**"):
+            return BinOp("**", tree, self.factor()) # right-associative
+        return tree
+
+    def primary(self):
+        tree = self.atom()
+        while self.take("["):
+            tree = Subscript(tree, self.index())
+            self.expect("]")
+        return tree
+
+    def index(self):
+        start = None if self.peek() in [":", "]"] else self.expr()
+        if not self.take(":"):
+            if start is None:
+                self.fail()
+            return start
+        stop = None if self.peek() in [":", "]"] else self.expr()
+        step = None
+        if self.take(":"):
+            step = None if self.peek() == "]" else self.expr()
+        return Slice(start, stop, step)
+
+    def atom(self):
+        kind, text, _ = self.tokens[self.i]
+        if kind == "name":
+            self.i += 1
+            return Name(text)
+        if kind == "number":
+            self.i += 1
+            return Number(int(text) if text.isdigit() else float(text))
+        if self.take("("):
+            tree = self.expr()
+            self.expect(")")
+            return tree
+        self.fail()
+
+TREES = LRUCache(maxsize=4096) # expression trees by formula
+
+def parse(formula):
+    """
+    Returns the (cached) expression tree of a formula.
+
+    Parameters
+    ----------
+    formula : str
+        A formula of scratch names and numbers combined with `+ - * / // % **
+        ~`, parentheses and slicing.
+    """
+    return TREES.get_or_put(formula, lambda: _Parser(formula).parse())
+
+
+### Evaluator
+##############################################################################
+
+BINARY = {"+": operator.add, "-": operator.sub, "*": operator.mul,
+          "/": operator.truediv, "//": operator.floordiv, "%": operator.mod,
+          "**": operator.pow}
+UNARY = {"-": operator.neg, "+": operator.pos, "~": operator.invert}
+
+def evaluate(tree, resolve):
+    """
+    Evaluates an expression tree with Python semantics, without executing any
+    code.
+
+    Parameters
+    ----------
+    tree : tuple
+        An expression tree returned by `parse`.
+    resolve : function
+        A function returning the value (e.g. the Scratch) of a name.
+    """
+    if isinstance(tree, Number):
+        return tree.value
+    if isinstance(tree, Name):
+        return resolve(tree.id)
+    if isinstance(tree, BinOp):
+        return BINARY[tree.op](evaluate(tree.left, resolve),
+                               evaluate(tree.right, resolve))
+    if isinstance(tree, UnaryOp):
+        return UNARY[tree.op](evaluate(tree.operand, resolve))
+    if isinstance(tree, Subscript):
+        return evaluate(tree.value, resolve)[evaluate(tree.index, resolve)]
+    if isinstance(tree, Slice):
+        return slice(*(None if i is None else evaluate(i, resolve) for i in tree))
+    raise TypeError(f'Unknown node: "{tree}"')
+
+def names(tree):
+    """Returns the names in an expression tree, in order of appearance"""
+    if isinstance(tree, Name):
+        return [tree.id]
+    if isinstance(tree, Number) or tree is None:
+        return []
+    if isinstance(tree, (UnaryOp, BinOp)):
+        return [n for child in tree[1:] for n in names(child)]
+    return [n for child in tree for n in names(child)]
+
+PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2, "//": 2, "%": 2, "**": 4}
+
+def _number(value):
+    """Formats a number the same way regardless of how it was written"""
+    if isinstance(value, int):
+        return str(value)
+    return np.format_float_positional(value, trim="0")
+
+def unparse(tree):
+    """
+    Returns the formula of an expression tree, with single spaces around 
+    binary operators and only the parentheses the precedence requires.
+    """
+    return _unparse(tree)[0]
+
+def _unparse(tree):
+    """Returns the formula of an expression tree and its precedence level"""
+    def wrap(node, level):
+        text, own = _unparse(node)
+        return f"({text})" if own < level else text
+    if isinstance(tree, Name):
+        return tree.id, 6
+    if isinstance(tree, Number):
+        return _number(tree.value), 6
+    if isinstance(tree, UnaryOp):
+        return tree.op + wrap(tree.operand, 3), 3
+    if isinstance(tree, BinOp):
+        level = PRECEDENCE[tree.op]
+        if tree.op == "**": # right-associative, binds tighter than unary on its left
+            return f"{wrap(tree.left, 5)} ** {wrap(tree.right, 3)}", level
+        return f"{wrap(tree.left, level)} {tree.op} {wrap(tree.right, level + 1)}", level
+    if isinstance(tree, Subscript):
+        return f"{wrap(tree.value, 5)}[{unparse(tree.index)}]", 5
+    if isinstance(tree, Slice):
+        parts = tree if tree.step is not None else tree[:2]
+        return ":".join("" if i is None else unparse(i) for i in parts), 0
+    raise TypeError(f'Unknown node: "{tree}"')
@@ -0,0 +1,181 @@
+"""
+`scratchbook.samples` implements the following classes:
+`SampleStore`
+    The decoded PCM data of a sample, handing out windows without copying.
+`SampleRegistry`
+    Sample stores by name, memory-mapped from wav files.
+"""
+
+import os
+import struct
+
+import numpy as np
+from pydub import AudioSegment
+
+from cache import LRUCache
+
+_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32} # pydub sample widths
+
+
+### Helper Functions
+##############################################################################
+
+STORES = LRUCache(maxsize=16, maxbytes=64 * 2**20, 
+                  sizeof=lambda entry: entry[1].pcm.nbytes) # stores by segment
+
+def as_store(sample):
+    """
+    Returns a sample as a SampleStore, wrapping (and caching) AudioSegments.
+    """
+    if isinstance(sample, SampleStore):
+        return sample
+    entry = STORES.get(id(sample))
+    if entry is None or entry[0] is not sample:
+        entry = (sample, # keeps id(sample) from being reused
+                 SampleStore.from_segment(sample))
+        STORES.put(id(sample), entry)
+    return entry[1]
+
+def _wav_data(path):
+    """
+    Returns the format chunk fields (format tag, channels, frame rate, byte 
+    rate, block align, bits per sample) of a wav file and the offset and size 
+    of its data chunk.
+    """
+    with open(path, "rb") as file:
+        riff, _, wave = struct.unpack("<4sI4s", file.read(12))
+        if not (riff == b"RIFF" and wave == b"WAVE"):
+            raise ValueError(f'Not a wav file: "{path}"')
+        fmt = None
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                raise ValueError(f'No data chunk in wav file: "{path}"')
+            chunk, size = struct.unpack("<4sI", header)
+            if chunk == b"data":
+                break
+            if chunk == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", file.read(16))
+                size -= 16
+            file.seek(size + size % 2, os.SEEK_CUR) # chunks are word-aligned
+        offset = file.tell()
+    if fmt is None:
+        raise ValueError(f'No format chunk in wav file: "{path}"')
+    size = min(size, os.path.getsize(path) - offset) # size may be a placeholder
+    return fmt, offset, size
+
+
+### Classes
+##############################################################################
+
+class SampleStore:
+    """
+    Holds the PCM data of a sample once, as a read-only array of shape
+    (frames, channels), so that the renderer can read (lift, height) windows
+    of it as views instead of slicing and reversing AudioSegments.
+    """
+
+    def __init__(self, pcm, frame_rate, sample_width):
+        """
+        Parameters
+        ----------
+        pcm : numpy.ndarray
+            The integer PCM data, of shape (frames, channels).
+        frame_rate : int
+            The number of frames per second.
+        sample_width : int
+            The number of bytes per sample.
+        """
+        pcm = pcm.view()
+        pcm.flags.writeable = False # shared between renders
+        self.pcm = pcm
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+
+    @classmethod
+    def from_segment(cls, segment):
+        """Returns a store of the PCM data of an AudioSegment (without copying)"""
+        pcm = np.frombuffer(segment.raw_data, dtype=_DTYPES[segment.sample_width])
+        return cls(pcm.reshape(-1, segment.channels), segment.frame_rate,
+                   segment.sample_width)
+
+    @classmethod
+    def from_wav(cls, path):
+        """
+        Returns a store of the data chunk of a PCM wav file, memory-mapped 
+        read-only instead of decoded, so that its pages are only read when 
+        rendered and are shared with every other process mapping the file.
+        """
+        fmt, offset, size = _wav_data(path)
+        format_tag, channels, frame_rate, _, _, bits = fmt
+        sample_width = bits // 8
+        if not (format_tag == 1 and sample_width in [2, 4]):
+            raise ValueError(f'Only 16 and 32 bit PCM wav files are supported: "{path}"')
+        dtype = np.dtype(_DTYPES[sample_width]).newbyteorder("<")
+        pcm = np.memmap(path, dtype=dtype, mode="r", offset=offset, 
+            shape=(size // (channels * sample_width), channels))
+        return cls(np.asarray(pcm), frame_rate, sample_width)
+
+    def __len__(self):
+        """The number of frames"""
+        return len(self.pcm)
+
+    @property
+    def channels(self):
+        """int: The number of channels"""
+        return self.pcm.shape[1]
+
+    def window(self, lift, height):
+        """
+        Returns a view of the part of the sample from lift to lift + height,
+        both relative to the length of the sample.
+        """
+        start = int(len(self.pcm) * lift)
+        stop = int(len(self.pcm) * (height + lift))
+        return self.pcm[start:stop]
+
+    def segment(self):
+        """Returns the sample as an AudioSegment (for the pydub engine)"""
+        return AudioSegment(data=self.pcm.tobytes(),
+            sample_width=self.sample_width, frame_rate=self.frame_rate,
+            channels=self.channels)
+
+
+class SampleRegistry:
+    """
+    A collection of sample stores by name (scratch samples as well as 
+    instrumentals), memory-mapped from wav files when registered.
+    """
+
+    def __init__(self):
+        self._stores = {}
+
+    def __getitem__(self, name):
+        return self._stores[name]
+
+    def __contains__(self, name):
+        return name in self._stores
+
+    @property
+    def names(self):
+        """list: The names of the registered samples"""
+        return list(self._stores)
+
+    def register(self, name, sample):
+        """
+        Registers a sample under a name and returns its store.
+
+        Parameters
+        ----------
+        name : str
+            The name of the sample.
+        sample : str, SampleStore or AudioSegment
+            The path of a wav file (memory-mapped), or an already decoded 
+            sample.
+        """
+        if isinstance(sample, (str, os.PathLike)):
+            store = SampleStore.from_wav(sample)
+        else:
+            store = as_store(sample)
+        self._stores[name] = store
+        return store
@@ -113,7 +113,7 @@ $(document).ready(function () {
           $(".home-scratch__audio").append(`
           <audio controls loop>
             <source
-              src="/formulas/${processedFormula}/scratchbook_audio"
+              src="/formulas/${processedFormula}/scratchbook_audio?quality=draft"
               type="audio/wav">
             Your browser does not support the audio element.
           </audio>
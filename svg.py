@@ -0,0 +1,141 @@
+"""
+`scratchbook.svg` implements the following function:
+`ttm_svg`
+    Writes the TTM of a scratch as the text of an svg file, without building
+    a matplotlib figure.
+"""
+
+import numpy as np
+
+COLORS = {"b": "#0000ff", "g": "#008000", "r": "#ff0000", "c": "#00bfbf",
+          "m": "#bf00bf", "y": "#bfbf00", "k": "#000000",
+          "w": "#ffffff"} # matplotlib single letter colors
+
+# the layout of `Scratch.TTM` after tight_layout, in points
+MARGINS = {"left": 32.12, "right": 32.12, "bottom": 41.8, "top": 10.8}
+PAD = 10.8 # between the figure edge and the axis labels
+FONT = 'font-family="DejaVu Sans, Bitstream Vera Sans, sans-serif" font-size="10"'
+
+
+### Helper Functions
+##############################################################################
+
+def _color(color):
+    """Returns an svg color for a matplotlib color name or hex string"""
+    return COLORS.get(color, color)
+
+def _points(x, y):
+    """Returns the points attribute of an svg polyline"""
+    return " ".join(f"{i:.2f},{j:.2f}" for i, j in zip(x.tolist(), y.tolist()))
+
+def _minor(lower, upper, n=12):
+    """
+    Returns the minor tick locations between lower and upper (n per unit,
+    without the major ones at integers), like `MyLocator`.
+    """
+    ticks = np.arange(np.ceil(lower * n), np.floor(upper * n) + 1) / n
+    return ticks[np.round(ticks * n) % n != 0]
+
+
+### Writer
+##############################################################################
+
+def ttm_svg(scratch, ppb=100, size=2):
+    """
+    Returns the text of an svg file of the Turntable Transcription
+    Methodology (TTM) of a scratch, with the layout of `Scratch.TTM` (beat
+    grid and shading, four beat bars, axis labels), drawn from the sampled
+    motion of the scratch.
+
+    Parameters
+    ----------
+    scratch : Scratch
+        The scratch to be transcribed.
+    ppb : int
+        The resolution of the graph in terms of the number of points per beat.
+    size : float
+        The height of the graph (and width of a beat) in inches.
+    """
+    beats = scratch.beats
+    width, height = beats * size * 72, size * 72
+    left, top = MARGINS["left"], MARGINS["top"]
+    right = width - MARGINS["right"]
+    bottom = height - MARGINS["bottom"]
+    margin = .1
+    xmin, xmax = 0 - margin, beats + margin
+    ymin, ymax = 0 - margin, 1 + margin
+    px = lambda x: left + (np.asarray(x) - xmin) / (xmax - xmin) * (right - left)
+    py = lambda y: bottom - (np.asarray(y) - ymin) / (ymax - ymin) * (bottom - top)
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:g}pt" '
+           f'height="{height:g}pt" viewBox="0 0 {width:g} {height:g}">',
+           f'<defs><clipPath id="axes"><rect x="{left:.2f}" y="{top:.2f}" '
+           f'width="{right - left:.2f}" height="{bottom - top:.2f}"/>'
+           f'</clipPath></defs>',
+           f'<rect width="{width:g}" height="{height:g}" fill="#ffffff"/>']
+    # beat shading, from 8.2 % to 91.8 % of the axes height
+    strangescalar = .82
+    y0 = bottom - margin * strangescalar * (bottom - top)
+    y1 = top + margin * strangescalar * (bottom - top)
+    for i in range(beats):
+        fill = "#cccccc" if i % 2 == 0 else "#e6e6e6"
+        out.append(f'<rect x="{px(i):.2f}" y="{y1:.2f}" '
+                   f'width="{px(i + 1) - px(i):.2f}" height="{y0 - y1:.2f}" '
+                   f'fill="{fill}" fill-opacity="0.5"/>')
+    # grid
+    out.append('<g stroke="#787878" stroke-width="0.5" '
+               'stroke-dasharray="0.5,0.825">')
+    out += [f'<line x1="{x:.2f}" y1="{top:.2f}" x2="{x:.2f}" y2="{bottom:.2f}"/>'
+            for x in px(_minor(xmin, xmax))]
+    out += [f'<line x1="{left:.2f}" y1="{y:.2f}" x2="{right:.2f}" y2="{y:.2f}"/>'
+            for y in py(_minor(ymin, ymax))]
+    out.append('</g>')
+    out.append('<g stroke="#2e2d2d" stroke-width="0.8">')
+    out += [f'<line x1="{x:.2f}" y1="{top:.2f}" x2="{x:.2f}" y2="{bottom:.2f}"/>'
+            for x in px(np.arange(beats + 1))]
+    out += [f'<line x1="{left:.2f}" y1="{y:.2f}" x2="{right:.2f}" y2="{y:.2f}"/>'
+            for y in py([0, 1])]
+    out.append('</g>')
+    out.append('<g stroke="#000000" stroke-width="1.5">')
+    out += [f'<line x1="{x:.2f}" y1="{top:.2f}" x2="{x:.2f}" y2="{bottom:.2f}"/>'
+            for x in px(np.arange(0, beats, 4))]
+    out.append('</g>')
+    # curves and clicks
+    motion = scratch.sample(ppb)
+    x, y = px(motion.time), py(motion.position)
+    out.append('<g clip-path="url(#axes)" fill="none" stroke-width="3" '
+               'stroke-linecap="square" stroke-linejoin="round">')
+    out += [f'<polyline stroke="{_color(color)}" points="{_points(x[start:stop], y[start:stop])}"/>'
+            for start, stop, color in zip(motion.offsets[:-1],
+                motion.offsets[1:], scratch.columns.color)]
+    out.append('</g>')
+    out.append('<g clip-path="url(#axes)" fill="#ffffff" stroke="#000000" '
+               'stroke-width="1">')
+    out += [f'<circle cx="{i:.2f}" cy="{j:.2f}" r="4"/>' for i, j in zip(
+        px(motion.click_time).tolist(), py(motion.click_position).tolist())]
+    out.append('</g>')
+    # axes frame, ticks and labels
+    out.append(f'<rect x="{left:.2f}" y="{top:.2f}" width="{right - left:.2f}" '
+               f'height="{bottom - top:.2f}" fill="none" stroke="#000000" '
+               f'stroke-width="0.8" stroke-linecap="square"/>')
+    ticks = [(x, bottom, x, bottom + 3.5) for x in px(np.arange(beats + 1))]
+    ticks += [(x0, y, x0 + dx, y) for y in py([0, 1])
+              for x0, dx in [(left, -3.5), (right, 3.5)]]
+    minor = [(x, bottom, x, bottom + 2) for x in px(_minor(xmin, xmax))]
+    minor += [(x0, y, x0 + dx, y) for y in py(_minor(ymin, ymax))
+              for x0, dx in [(left, -2), (right, 2)]]
+    for lines, linewidth in [(ticks, 0.8), (minor, 0.6)]:
+        out.append(f'<g stroke="#000000" stroke-width="{linewidth}">')
+        out += [f'<line x1="{x1:.2f}" y1="{y1:.2f}" x2="{x2:.2f}" y2="{y2:.2f}"/>'
+                for x1, y1, x2, y2 in lines]
+        out.append('</g>')
+    out.append(f'<g {FONT} fill="#000000" text-anchor="middle">')
+    out += [f'<text x="{x:.2f}" y="{bottom + 14.6:.2f}">{i + 1}</text>'
+            for i, x in enumerate(px(np.arange(beats)))]
+    out.append(f'<text x="{(left + right) / 2:.2f}" '
+               f'y="{height - PAD - 2.4:.2f}">Beats</text>')
+    for x in [PAD + 7.92, width - PAD - 2.72]:
+        out.append(f'<text transform="translate({x:.2f} {(top + bottom) / 2:.2f}) '
+                   f'rotate(-90)">Sample</text>')
+    out.append('</g>')
+    out.append('</svg>')
+    return "\n".join(out)